@@ -1,17 +1,40 @@
 import streamlit as st
 import geopandas as gpd
 import folium
-from folium.plugins import HeatMap, MarkerCluster
-from streamlit_folium import folium_static
+from folium.plugins import HeatMap
+from streamlit_folium import st_folium
 import matplotlib.pyplot as plt
+import numpy as np
+import hashlib
 import json
 
+import perf
+from classification import SCHEMES, categorize, classify
+from geojson_loader import parse_bbox, read_geojson
+from map_layers import COORDINATE_DECIMALS, CirclePointLayer, ClusterLayer, Legend, ShapeLayer
+from render_cache import UploadedDataset, map_bytes, render_cache
+from spatial_index import (HEAT_GRIDS, HEAT_PIXELS, ClusterIndex, GeometryLevels, HeatIndex, ViewportIndex, fit_zoom,
+                           viewport)
+
 # Function to display error message for incorrect column selection
 def display_error(message):
     st.error(message)
 
+SYMBOLOGIES = ["Flat", "Categorized", "Graduated", "Point Cluster", "Heat Map"]
+GRADUATED_STYLES = ["By Size", "By Color", "By Both"]
+
+# Uploads larger than this are streamed, keeping only the columns a symbology needs
+STREAMING_THRESHOLD = 50 * 1024 * 1024
+
 # Function to read the uploaded file and convert to GeoDataFrame
-def load_geospatial_data(file):
+def load_geospatial_data(file, properties=None, bbox=None, limit=None):
+    if file.size > STREAMING_THRESHOLD:
+        try:
+            file.seek(0)
+            return read_geojson(file, properties, bbox, limit)
+        except Exception as e:
+            display_error(f"Error loading file: {e}")
+            return None
     try:
         # Attempt to read as a GeoJSON
         geo_df = gpd.read_file(file)
@@ -26,146 +49,273 @@ def load_geospatial_data(file):
             display_error(f"Error loading file: {e}")
             return None
 
-# Function to render map using Folium
-def render_map(geo_df, symbology, column=None, graduated_style=None):
-    # Initialize Folium map centered on the average coordinates of the dataset
-    m = folium.Map(location=[geo_df.geometry.centroid.y.mean(), geo_df.geometry.centroid.x.mean()], zoom_start=10)
+# Content hash of an upload, computed once per uploaded file rather than on every rerun
+def upload_digest(file):
+    state_key = f"upload-digest-{file.file_id}"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = hashlib.blake2b(file.getvalue(), digest_size=16).hexdigest()
+    return st.session_state[state_key]
+
+# Class breaks, colors and legend of a column, computed once per dataset and scheme
+@st.cache_data(max_entries=32)
+def classify_column(_geo_df, dataset_key, column, scheme, k=None):
+    values = _geo_df[column]
+    with perf.span('render.classify', column=column, scheme=scheme):
+        if scheme == "Categories":
+            return categorize(values)
+        return classify(values.to_numpy(dtype=float), scheme, k)
+
+# Parsed upload with its positions, bounds and center, shared by every rerun
+# (each pan or zoom is one); treat as read-only
+def load_dataset(file, dataset_key, properties=None, bbox=None, limit=None):
+    def build():
+        with perf.span('parse.load_dataset', bytes=file.size):
+            geo_df = load_geospatial_data(file, properties, bbox, limit)
+            return None if geo_df is None else UploadedDataset(dataset_key, geo_df)
+    cache_key = ('dataset', dataset_key, None if properties is None else tuple(properties))
+    return render_cache.get(cache_key, build, UploadedDataset.nbytes)
+
+# One property of a streamed upload, read when a symbology first needs it
+def load_column(file, dataset, column, bbox=None, limit=None):
+    def build():
+        file.seek(0)
+        return dataset.with_column(column, read_geojson(file, [column], bbox, limit, geometry=False)[column])
+    # The geometry is shared with `dataset`; only the new column adds to the cache
+    size = lambda loaded: int(loaded.geo_df[column].memory_usage(deep=True))
+    return render_cache.get(('dataset', dataset.key, (column,)), build, size)
+
+# Spatial index for viewport queries, built once per dataset
+@st.cache_resource(max_entries=4)
+def viewport_index(_dataset, dataset_key):
+    with perf.span('render.build_viewport_index'):
+        return ViewportIndex(_dataset.geo_df, _dataset.lat, _dataset.lon)
+
+# Cluster hierarchy over every zoom level, built once per dataset
+@st.cache_resource(max_entries=4)
+def cluster_index(_dataset, dataset_key):
+    with perf.span('render.build_cluster_index'):
+        return ClusterIndex(_dataset.lat, _dataset.lon)
+
+# Weighted positions for the heat map, projected once per dataset and column
+@st.cache_resource(max_entries=4)
+def heat_index(_dataset, dataset_key, column):
+    with perf.span('render.build_heat_index'):
+        return HeatIndex(_dataset.lat, _dataset.lon, _dataset.geo_df[column].to_numpy(dtype=float))
+
+MAP_WIDTH, MAP_HEIGHT = 700, 500
+
+# Last view reported by the interactive map under `key`, as (center, zoom, bounds),
+# or the default view before the map has reported one
+def map_view(key, center, zoom=10):
+    state = st.session_state.get(key) or {}
+    if state.get('center') and state.get('zoom') is not None:
+        center, zoom = [state['center']['lat'], state['center']['lng']], state['zoom']
+    bounds = state.get('bounds')
+    if bounds and bounds.get('_southWest') and bounds.get('_northEast'):
+        south_west, north_east = bounds['_southWest'], bounds['_northEast']
+        bounds = (south_west['lat'], south_west['lng'], north_east['lat'], north_east['lng'])
+    else:
+        bounds = viewport(center, zoom, MAP_WIDTH, MAP_HEIGHT)
+    return center, zoom, bounds
+
+# Lines and polygons simplified for several zooms, built once per dataset
+@st.cache_resource(max_entries=4)
+def geometry_levels(_dataset, dataset_key):
+    with perf.span('render.build_geometry_levels'):
+        return GeometryLevels(_dataset.geo_df.geometry.to_numpy())
+
+# Add the features at positions `shown` to the map: points as circle markers,
+# lines and polygons at the level of detail for `zoom`, with the radius as
+# their outline width
+def draw_features(m, dataset, shown, zoom, palette, color=0, radius=5):
+    levels = geometry_levels(dataset, dataset.key)
+    with perf.span('render.draw_features', features=len(shown)):
+        is_shape = levels.is_shape[shown]
+        part = lambda values, mask: values[mask] if np.ndim(values) else values
+        if (~is_shape).any():
+            points = shown[~is_shape]
+            CirclePointLayer(dataset.lat[points], dataset.lon[points], palette, color=part(color, ~is_shape),
+                             radius=part(radius, ~is_shape)).add_to(m)
+        if is_shape.any():
+            ShapeLayer(levels.geojson(zoom, shown[is_shape]), palette, color=part(color, is_shape),
+                       weight=part(radius, is_shape) / 5).add_to(m)
+
+# Sidebar options of a symbology, or None (after an error message) when the
+# column does not suit it
+def symbology_options(geo_df, symbology, column):
+    if symbology == "Categorized":
+        if geo_df[column].dtype != 'object':
+            display_error("Selected column is not suitable for categorization. Please select a categorical column.")
+            return None
+    elif symbology == "Graduated":
+        values = geo_df[column]
+        try:
+            values = values.astype(float)
+        except:
+            pass
+        if values.dtype not in ['int64', 'float64']:
+            display_error("Selected column is not suitable for graduated symbology. Please select a numerical column.")
+            return None
+        return {
+            "graduated_style": st.sidebar.selectbox("Select Graduated Style", GRADUATED_STYLES),
+            "scheme": st.sidebar.selectbox("Classification", SCHEMES),
+            "k": st.sidebar.slider("Number of Classes", min_value=2, max_value=9, value=5),
+        }
+    elif symbology == "Heat Map":
+        if geo_df[column].dtype not in ['int64', 'float64']:
+            display_error("Selected column is not suitable for heat map. Please select a numerical column.")
+            return None
+        return {
+            "grid": st.sidebar.selectbox("Heat Map Grid", HEAT_GRIDS),
+            "smoothing": st.sidebar.slider("KDE Smoothing (cells)", min_value=0.0, max_value=3.0, value=0.0, step=0.5),
+        }
+    return {}
+
+# Build the folium map of one view. Returns (map, notes to show above it);
+# `options` is None when the column did not suit the symbology, which leaves the map empty
+def build_map(dataset, symbology, column, options, center, zoom, bounds):
+    geo_df = dataset.geo_df
+    m = folium.Map(location=center, zoom_start=zoom, prefer_canvas=True)
+    notes = []
+    if options is None:
+        return m, notes
+
+    if symbology in ["Flat", "Categorized", "Graduated"]:
+        # Features in view, thinned to one per few pixels when zoomed out
+        index = viewport_index(dataset, dataset.key)
+        with perf.span('render.viewport_query') as span:
+            shown = index.query(zoom, bounds)
+            span.set(shown=len(shown))
+        notes.append(f"Drawing {len(shown):,} of {len(geo_df):,} features.")
 
     if symbology == "Flat":
         # Simple flat symbology: color all points uniformly
-        for _, row in geo_df.iterrows():
-            folium.CircleMarker(
-                location=[row.geometry.y, row.geometry.x],
-                radius=5,
-                color='blue',
-                fill=True,
-                fill_color='blue',
-                fill_opacity=0.7,
-            ).add_to(m)
-        st.write("Displaying flat symbology.")
+        draw_features(m, dataset, shown, zoom, ['blue'])
+        notes.append("Displaying flat symbology.")
 
     elif symbology == "Categorized":
         # Categorical symbology with unique colors for each category
-        if geo_df[column].dtype == 'object':
-            unique_values = geo_df[column].unique()
-            colormap = plt.cm.get_cmap('Set1', len(unique_values))
-            for _, row in geo_df.iterrows():
-                color = colormap(unique_values.tolist().index(row[column]))
-                folium.CircleMarker(
-                    location=[row.geometry.y, row.geometry.x],
-                    radius=5,
-                    color=f'#{int(color[0]*255):02x}{int(color[1]*255):02x}{int(color[2]*255):02x}',
-                    fill=True,
-                    fill_color=f'#{int(color[0]*255):02x}{int(color[1]*255):02x}{int(color[2]*255):02x}',
-                    fill_opacity=0.7,
-                ).add_to(m)
-            st.write("Displaying categorized symbology.")
-        else:
-            display_error("Selected column is not suitable for categorization. Please select a categorical column.")
+        classification = classify_column(geo_df, dataset.key, column, "Categories")
+        draw_features(m, dataset, shown, zoom, classification.palette, color=classification.classes[shown])
+        Legend(column, classification.legend()).add_to(m)
+        notes.append("Displaying categorized symbology.")
 
     elif symbology == "Graduated":
         # Graduated symbology based on numerical data with additional style choices
-        try:
-            geo_df[column] = geo_df[column].astype(float)
-        except:
-            pass
-        if geo_df[column].dtype in ['int64', 'float64']:
-            graduated_style = st.sidebar.selectbox("Select Graduated Style", ["By Size", "By Color", "By Both"])
-            min_val, max_val = geo_df[column].min(), geo_df[column].max()
-            
-            for _, row in geo_df.iterrows():
-                value = row[column]
-                normalized_value = (value - min_val) / (max_val - min_val)
-                # Gradient color from green to red
-                color = plt.cm.get_cmap('RdYlGn_r')(normalized_value)  # Reversed to go from green to red
-                
-                # Adjust radius based on value
-                radius = 5 + normalized_value * 10
-                
-                # Determine style based on the selected option
-                if graduated_style == "By Size":
-                    folium.CircleMarker(
-                        location=[row.geometry.y, row.geometry.x],
-                        radius=radius,
-                        color='blue',
-                        fill=True,
-                        fill_color='blue',
-                        fill_opacity=0.7,
-                    ).add_to(m)
-                elif graduated_style == "By Color":
-                    folium.CircleMarker(
-                        location=[row.geometry.y, row.geometry.x],
-                        radius=5,
-                        color=f'#{int(color[0]*255):02x}{int(color[1]*255):02x}{int(color[2]*255):02x}',
-                        fill=True,
-                        fill_color=f'#{int(color[0]*255):02x}{int(color[1]*255):02x}{int(color[2]*255):02x}',
-                        fill_opacity=0.7,
-                    ).add_to(m)
-                elif graduated_style == "By Both":
-                    folium.CircleMarker(
-                        location=[row.geometry.y, row.geometry.x],
-                        radius=radius,
-                        color=f'#{int(color[0]*255):02x}{int(color[1]*255):02x}{int(color[2]*255):02x}',
-                        fill=True,
-                        fill_color=f'#{int(color[0]*255):02x}{int(color[1]*255):02x}{int(color[2]*255):02x}',
-                        fill_opacity=0.7,
-                    ).add_to(m)
-            st.write(f"Displaying graduated symbology by {graduated_style.lower()}.")
-        else:
-            display_error("Selected column is not suitable for graduated symbology. Please select a numerical column.")
+        graduated_style, scheme = options["graduated_style"], options["scheme"]
+        classification = classify_column(geo_df, dataset.key, column, scheme, options["k"])
+        classes = classification.classes[shown]
+        # Adjust radius based on class; features without a value get the smallest
+        radius = 5 + np.where(classes >= classification.k, 0, classes) / max(classification.k - 1, 1) * 10
+
+        if graduated_style == "By Size":
+            draw_features(m, dataset, shown, zoom, ['blue'], radius=radius)
+        elif graduated_style == "By Color":
+            draw_features(m, dataset, shown, zoom, classification.palette, color=classes)
+        elif graduated_style == "By Both":
+            draw_features(m, dataset, shown, zoom, classification.palette, color=classes, radius=radius)
+        if graduated_style != "By Size":
+            Legend(f"{column} ({scheme})", classification.legend()).add_to(m)
+        notes.append(f"Displaying graduated symbology by {graduated_style.lower()}.")
 
     elif symbology == "Point Cluster":
-        # Cluster symbology for point data
-        marker_cluster = MarkerCluster().add_to(m)
-        for _, row in geo_df.iterrows():
-            folium.CircleMarker(
-                location=[row.geometry.y, row.geometry.x],
-                radius=5,
-                color='blue',
-                fill=True,
-                fill_color='blue',
-                fill_opacity=0.7,
-            ).add_to(marker_cluster)
-        st.write("Displaying point cluster symbology.")
+        # Cluster symbology for point data: the clusters are precomputed for
+        # every zoom, and the map only receives those of the current view
+        index = cluster_index(dataset, dataset.key)
+        with perf.span('render.clusters'):
+            ClusterLayer(*index.clusters(zoom, bounds)).add_to(m)
+        notes.append("Displaying point cluster symbology.")
 
     elif symbology == "Heat Map":
-        # Heatmap symbology
-        if geo_df[column].dtype in ['int64', 'float64']:
-            heat_data = [[row.geometry.y, row.geometry.x, row[column]] for _, row in geo_df.iterrows()]
-            HeatMap(heat_data).add_to(m)
-            st.write("Displaying heat map symbology.")
-        else:
-            display_error("Selected column is not suitable for heat map. Please select a numerical column.")
+        # Heatmap symbology: the weighted points are binned on the server for
+        # the current view, and only the non-empty cells go to the map
+        index = heat_index(dataset, dataset.key, column)
+        with perf.span('render.heat_bins'):
+            cells = index.bins(zoom, bounds, grid=options["grid"], smoothing=options["smoothing"])
+            heat_data = np.column_stack(cells).round(COORDINATE_DECIMALS).tolist()
+            # max_zoom at the current zoom keeps leaflet.heat from scaling the cells down again
+            HeatMap(heat_data, radius=HEAT_PIXELS, blur=HEAT_PIXELS, max_zoom=int(zoom)).add_to(m)
+        notes.append("Displaying heat map symbology.")
+
+    return m, notes
+
+# Function to render map using Folium
+def render_map(dataset, symbology, column=None, graduated_style=None):
+    options = symbology_options(dataset.geo_df, symbology, column)
+    # The map reports its view back, so pan and zoom rerun the script and
+    # only what is in view is sent; the view is kept when switching modes
+    map_key = f"map-{dataset.key}"
+    # Initialize the view on the dataset's center, zoomed to fit it
+    default_zoom = min(10, fit_zoom(dataset.bounds, MAP_WIDTH, MAP_HEIGHT)) if dataset.bounds else 10
+    center, zoom, bounds = map_view(map_key, dataset.center, default_zoom)
+    # Finished maps are kept per upload, settings and view, so reruns caused
+    # by unrelated widgets and returns to an earlier view skip the rebuild
+    render_key = ('map', dataset.key, symbology, column, tuple(sorted((options or {}).items())),
+                  zoom, tuple(round(value, 6) for value in bounds))
+    def build():
+        # One span per symbology branch; none at all when the map comes from the cache
+        with perf.span(f"render.{symbology.lower().replace(' ', '_')}", zoom=zoom):
+            return build_map(dataset, symbology, column, options, center, zoom, bounds)
+    m, notes = render_cache.get(render_key, build, map_bytes)
+    for note in notes:
+        st.write(note)
 
     # Display map
-    folium_static(m)
+    with perf.span('render.st_folium'):
+        st_folium(m, key=map_key, width=MAP_WIDTH, height=MAP_HEIGHT, returned_objects=["zoom", "center", "bounds"])
 
 # Streamlit App Layout
-st.title("Symbology Demo with GeoPandas and Streamlit")
-st.sidebar.title("Upload and Select Options")
-
-# File Upload Section
-uploaded_file = st.sidebar.file_uploader("Upload a GeoJSON or JSON file", type=["geojson", "json"])
-if uploaded_file:
-    geo_df = load_geospatial_data(uploaded_file)
-    
-    if geo_df is not None:
-        st.sidebar.success("File uploaded successfully!")
-        
-        # Display the dataframe
-        st.write("Uploaded GeoDataFrame:")
-        st.write(geo_df.head())
-
-        # Symbology Options
-        symbology = st.sidebar.selectbox("Select Symbology Type", ["Flat", "Categorized", "Graduated", "Point Cluster", "Heat Map"])
-        
-        # Column Selection Based on Symbology Type
-        column = None
-        graduated_style = None
-        if symbology in ["Categorized", "Graduated", "Heat Map"]:
-            column = st.sidebar.selectbox("Select Column for Symbology", geo_df.columns)
-        
-        # Render Map Based on Selection
-        render_map(geo_df, symbology, column, graduated_style)
-else:
-    st.info("Please upload a GeoJSON or JSON file to proceed.")
+def main():
+    st.title("Symbology Demo with GeoPandas and Streamlit")
+    st.sidebar.title("Upload and Select Options")
+
+    # File Upload Section
+    uploaded_file = st.sidebar.file_uploader("Upload a GeoJSON or JSON file", type=["geojson", "json"])
+    if uploaded_file:
+        # Identifies the upload's contents in cache keys
+        dataset_key = upload_digest(uploaded_file)
+        streaming = uploaded_file.size > STREAMING_THRESHOLD
+        bbox, limit = None, None
+        if streaming:
+            # Large uploads are read geometry first; property columns follow on demand
+            st.sidebar.caption(f"Large upload ({uploaded_file.size / 1024 / 1024:.0f} MB): "
+                               "only the geometry and the selected column are loaded.")
+            limit = st.sidebar.number_input("Feature Limit (0 for all)", min_value=0, value=0, step=1000) or None
+            try:
+                bbox = parse_bbox(st.sidebar.text_input("Bounding Box (west, south, east, north)"))
+            except ValueError as e:
+                st.sidebar.error(str(e))
+            # The filters decide which features are kept, so they are part of the dataset's identity
+            dataset_key = f"{dataset_key}-{limit}-{bbox}"
+        dataset = load_dataset(uploaded_file, dataset_key, [] if streaming else None, bbox, limit)
+
+        if dataset is not None:
+            geo_df = dataset.geo_df
+            st.sidebar.success("File uploaded successfully!")
+
+            # Display the dataframe
+            st.write("Uploaded GeoDataFrame:")
+            st.write(geo_df.head())
+
+            # Symbology Options
+            symbology = st.sidebar.selectbox("Select Symbology Type", SYMBOLOGIES)
+
+            # Column Selection Based on Symbology Type
+            column = None
+            graduated_style = None
+            if symbology in ["Categorized", "Graduated", "Heat Map"]:
+                column = st.sidebar.selectbox("Select Column for Symbology", geo_df.attrs.get('properties', geo_df.columns))
+                if column not in geo_df.columns:
+                    dataset = load_column(uploaded_file, dataset, column, bbox, limit)
+
+            # Render Map Based on Selection
+            render_map(dataset, symbology, column, graduated_style)
+    else:
+        st.info("Please upload a GeoJSON or JSON file to proceed.")
+
+
+if __name__ == "__main__":
+    # Timings of this rerun, shown with ?perf=1 or PERF_PANEL=1 and logged with PERF_LOG
+    perf_trace = perf.start_page("Symbology")
+    main()
+    perf.show_panel(perf_trace)
@@ -1,12 +1,33 @@
 import streamlit as st
 import os
-import boto3
 import json
 import pandas as pd
-import ijson
 from datetime import datetime, timezone
 from botocore.exceptions import ClientError
 
+from column_profiler import suggest_columns
+from dataset_schema import build_schema, read_schema, schema_key_for, write_schema
+from geojson_stream import MAX_STRATA, SAMPLING_MODES, convert_to_dataframe, format_parse, read_columns, stream_json_file
+from metadata_audit import (
+    candidate_columns,
+    column_mismatches,
+    dataset_columns,
+    dataset_keys,
+    empty_metadata,
+    metadata_key_for,
+    new_column_entry,
+    normalize_metadata,
+    with_geom,
+)
+from metadata_catalog import (
+    find_index_entry,
+    load_metadata_index,
+    rebuild_metadata_index,
+    update_metadata_index,
+)
+from perf import show_panel, start_page
+from s3_utils import get_s3_client, list_keys
+
 # AWS credentials from Streamlit secrets
 aws_access_key_id = st.secrets["Access_key_ID"]
 aws_default_region = st.secrets["AWS_DEFAULT_REGION"]
@@ -17,45 +38,40 @@ if aws_secret_access_key == "":
     st.stop()
 
 # Initialize S3 client
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=aws_access_key_id,
-    aws_secret_access_key=aws_secret_access_key,
-    region_name=aws_default_region
-)
+s3 = get_s3_client(aws_access_key_id, aws_secret_access_key, aws_default_region)
 bucket_name = 'dev-data-layer-datasets'
 
 # Helper functions
 def list_files_in_folder(bucket, prefix):
-    paginator = s3.get_paginator('list_objects_v2')
-    page_iterator = paginator.paginate(Bucket=bucket, Prefix=prefix)
-
-    files = []
-    for page in page_iterator:
-        if "Contents" in page:
-            for obj in page['Contents']:
-                files.append(obj['Key'])
-    return files
-
-def stream_json_file(s3, bucket, key, limit=1000):
-    response = s3.get_object(Bucket=bucket, Key=key)
-    objects = ijson.items(response['Body'], 'features.item')
-
-    # Collect up to `limit` features
-    limited_features = [feature for _, feature in zip(range(limit), objects)]
-
-    # Reconstruct a partial JSON object
-    partial_json = {
-        'type': 'FeatureCollection',
-        'features': limited_features
-    }
-    return partial_json
-
-def convert_to_dataframe(geojson_features):
-    # Extract the properties from each feature
-    properties_list = [feature['properties'] for feature in geojson_features['features']]
-    df = pd.DataFrame(properties_list)
-    return df
+    return list_keys(s3, bucket, prefix)
+
+@st.cache_data(show_spinner="Sampling features...", max_entries=16)
+def sample_dataset(_s3, bucket, key, etag, sampling, memory_budget, stratify_by):
+    # A fixed seed keeps random samples stable across reruns of the same version. Only the
+    # sampling modes come here, so the memory budget bounds the sample rather than a count.
+    return stream_json_file(_s3, bucket, key, limit=None, sampling=sampling, memory_budget=memory_budget,
+                            stratify_by=stratify_by, seed=0)
+
+@st.cache_data(show_spinner="Reading features...", max_entries=16)
+def read_dataset_head(_s3, bucket, key, etag):
+    # Properties only: the parser skips the geometries
+    return read_columns(_s3, bucket, key)
+
+@st.cache_data(show_spinner="Reading dataset schema...", max_entries=32)
+def read_dataset_schema(_s3, bucket, key, etag):
+    # The schema sidecar of this version of the dataset, or None when it has none yet
+    return read_schema(_s3, bucket, key, etag)
+
+@st.cache_data(show_spinner="Profiling all features...", max_entries=32)
+def profile_dataset(_s3, bucket, key, etag):
+    # `etag` only keys the cache, so a new version of the object is profiled again.
+    # The profile is stored as the dataset's schema sidecar, so later reads skip this pass.
+    schema = build_schema(_s3, bucket, key)
+    try:
+        write_schema(_s3, bucket, schema)
+    except ClientError as e:
+        st.warning(f"Could not save the schema sidecar: {str(e)}")
+    return schema
 
 def read_metadata(bucket, key):
     response = s3.get_object(Bucket=bucket, Key=key)
@@ -67,11 +83,16 @@ def upload_json_to_s3(s3, data, bucket, key):
         # Convert the Python dictionary to a JSON string using the custom encoder
         json_string = json.dumps(data, ensure_ascii=False, indent=4, cls=MetadataEncoder)
         # Upload the JSON string to S3
-        s3.put_object(Body=json_string, Bucket=bucket, Key=key)
+        response = s3.put_object(Body=json_string, Bucket=bucket, Key=key)
     except Exception as e:
         st.error(f"Error saving metadata: {str(e)}")
         st.error(f"Metadata structure: {type(data)}")
         st.error(f"Metadata content: {data}")
+        return
+    try:
+        update_metadata_index(s3, bucket, key, response['ETag'], data)
+    except Exception as e:
+        st.warning(f"Metadata saved, but the metadata index could not be updated: {str(e)}")
 
 class MetadataEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -85,7 +106,8 @@ def save_metadata(metadata, s3, bucket_name, metadata_file):
     """
     try:
         metadata_json = json.dumps(metadata, indent=2, cls=MetadataEncoder)
-        s3.put_object(Body=metadata_json, Bucket=bucket_name, Key=metadata_file)
+        response = s3.put_object(Body=metadata_json, Bucket=bucket_name, Key=metadata_file)
+        update_metadata_index(s3, bucket_name, metadata_file, response['ETag'], metadata)
     except ClientError as e:
         raise Exception(f"Error saving metadata to S3: {str(e)}")
 
@@ -96,7 +118,7 @@ def main():
     # List JSON files in the 'datasets/' folder
     folder_prefix = 'datasets/'
     files = list_files_in_folder(bucket_name, folder_prefix)
-    json_files = [file for file in files if file.endswith('json') and file.count('/') == 1]
+    json_files = dataset_keys(files)
 
     # Load input data file
     input_file = st.selectbox("Select a file", json_files)
@@ -105,24 +127,65 @@ def main():
 
     if input_file:
         try:
-            # Load input data
-            input_data = stream_json_file(s3, bucket_name, input_file)
-            dfData = convert_to_dataframe(input_data)
-            
+            etag = s3.head_object(Bucket=bucket_name, Key=input_file)['ETag']
+
+            # Profile every feature, not just the preview sample, so columns that
+            # only appear later in the file are found and typed. The profile comes
+            # from the dataset's schema sidecar when it describes this version.
+            profile = read_dataset_schema(s3, bucket_name, input_file, etag)
+            if profile is not None:
+                st.caption(f"Schema from {schema_key_for(input_file)}, created {profile['created']}")
+            elif st.checkbox("Profile all features", value=True):
+                profile = profile_dataset(s3, bucket_name, input_file, etag)
+
+            # Load input data. Sorted datasets make the head of the file a poor
+            # sample, so the other modes read the whole stream within a memory budget.
+            sampling = st.selectbox("Sampling", SAMPLING_MODES)
+            memory_budget = None
+            stratify_by = None
+            if sampling != "head":
+                memory_budget = st.number_input("Sample memory budget (MB)", min_value=1, value=32) * 1024 * 1024
+            if sampling == "stratified":
+                if profile:
+                    # Columns with more values than strata (ids, measurements) would not stratify
+                    strata_columns = [column_name for column_name, column in profile["columns"].items()
+                                      if 0 < column["distinct"] <= MAX_STRATA]
+                    stratify_by = st.selectbox("Stratify by", strata_columns)
+                    if stratify_by is None:
+                        st.caption(f"No column has at most {MAX_STRATA} values; sampling uniformly instead.")
+                        sampling = "reservoir"
+                else:
+                    stratify_by = st.text_input("Stratify by (property name)", "state_name")
+            if sampling == "head" and profile:
+                # The first rows are in the schema, so nothing needs streaming
+                dfData = pd.DataFrame(profile["preview"])
+            elif sampling == "head":
+                dfData, parse_stats = read_dataset_head(s3, bucket_name, input_file, etag)
+                st.caption(format_parse(parse_stats))
+            else:
+                input_data = sample_dataset(s3, bucket_name, input_file, etag, sampling, memory_budget, stratify_by)
+                dfData = convert_to_dataframe(input_data)
+                sample = input_data["sample"]
+                st.caption(f"Sample: {sample['kept']} of {sample['seen']} features (~{sample['bytes'] / 1024 / 1024:.1f} MB)")
+
+            data_columns_found = dataset_columns(dfData.columns, profile)
+
             # Display actual columns in the data
             st.subheader("Actual Columns in Data")
-            st.write(dfData.columns.tolist())
+            st.write(data_columns_found)
+            if profile:
+                with st.expander(f"Column profile ({profile['feature_count']} features)"):
+                    st.dataframe(pd.DataFrame.from_dict(profile["columns"], orient="index").astype({"top": str}))
+                    if profile["bbox"]:
+                        st.caption("Bounding box (west, south, east, north): "
+                                   + ", ".join(f"{value:.5f}" for value in profile["bbox"]))
 
             show_preview = st.checkbox("Show data preview", value=True)
             if show_preview:
                 st.subheader("Sample Data")
                 st.table(dfData.head(5))
-            all_columns = [col for col in dfData.columns if col != 'geom']
-
             # Remove geometry columns from suggestions
-            for geom_col in ["geometry", "geom"]:
-                if geom_col in all_columns:
-                    all_columns.remove(geom_col)
+            all_columns = candidate_columns(data_columns_found)
 
             # New section for pasting JSON metadata
             st.subheader("Paste Metadata JSON")
@@ -138,79 +201,37 @@ def main():
             else:
                 # Existing code for loading metadata from S3
                 try:
-                    files_metadata = list_files_in_folder(bucket_name, 'metadata/')
-                    metadata_file = None
-                    for f in files_metadata:
-                        if name.split('.')[0].lower() in f.lower():
-                            metadata_file = read_metadata(bucket_name, f)
-                            break
+                    metadata_index = load_metadata_index(s3, bucket_name)
+                    entry = find_index_entry(metadata_index, name.split('.')[0])
+                    reconciled = st.session_state.setdefault('metadata_index_reconciled', set())
+                    if entry is None and input_file not in reconciled:
+                        # The index may predate this layer's metadata; reconcile it once per
+                        # session and dataset, since new layers have no metadata at all yet
+                        reconciled.add(input_file)
+                        metadata_index = rebuild_metadata_index(s3, bucket_name)
+                        entry = find_index_entry(metadata_index, name.split('.')[0])
+                    metadata_file = read_metadata(bucket_name, entry['key']) if entry else None
                 except Exception as e:
                     st.error(f"Error loading metadata: {e}")
                     metadata_file = None
 
             # Initialize metadata
-            metadataFormat = {
-                "name": "",
-                "layer_id": "",
-                "geom_type": "",
-                "geom_join": "",
-                "description": "",
-                "obj_details_column": "",
-                "has_biomass": False,
-                "has_county_geoid": False,
-                "value_columns": [],
-                "category_columns": [],
-                "details_columns": [],
-                "data_columns": [],
-                "tooltip-title": "",
-                "tooltip-content": "",
-                "s3_file_path": "",
-                "view_name": "",
-                "updated_at": "",
-                "details_modals": [],
-                "columns": [],
-                "calculated_fields": [],
-                "human_identifier_field": "",
-                "mandatory_filter": [],
-                "layer_access_level": 2,
-                "supplier_layer": False,
-                "visualization": {}
-            }
-
             if metadata_file is not None:
                 st.session_state.metadata = metadata_file
             else:
-                st.session_state.metadata = metadataFormat.copy()
+                st.session_state.metadata = empty_metadata()
 
-            # Remove extra keys not in metadataFormat
-            st.session_state.metadata = {k: v for k, v in st.session_state.metadata.items() if k in metadataFormat}
+            # Remove extra keys not in the metadata format and duplicates in the column lists
+            st.session_state.metadata = normalize_metadata(st.session_state.metadata)
 
             # Update 'updated_at' field
             st.session_state.metadata["updated_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
-            # **Handle duplicates in columns lists**
-            columns_to_deduplicate = ["value_columns", "category_columns", "details_columns", "data_columns"]
-            for col_list_name in columns_to_deduplicate:
-                col_list = st.session_state.metadata.get(col_list_name, [])
-                # Remove duplicates while preserving order
-                seen = set()
-                col_list_dedup = []
-                for item in col_list:
-                    if item not in seen:
-                        seen.add(item)
-                        col_list_dedup.append(item)
-                st.session_state.metadata[col_list_name] = col_list_dedup
-
             # Check for mismatches between metadata and actual data columns
             st.subheader("Column Mismatches")
-            metadata_columns = set(st.session_state.metadata.get("data_columns", []))
-            actual_columns = set(all_columns + ['geom'])
-            
-            missing_in_data = metadata_columns - actual_columns
+            missing_in_data, missing_in_metadata = column_mismatches(st.session_state.metadata, all_columns)
             if missing_in_data:
                 st.warning(f"Columns in metadata but not in data: {', '.join(missing_in_data)}")
-            
-            missing_in_metadata = actual_columns - metadata_columns
             if missing_in_metadata:
                 st.warning(f"Columns in data but not in metadata: {', '.join(missing_in_metadata)}")
 
@@ -239,7 +260,11 @@ def main():
                 "Details Columns": "details_columns"
             }
 
+            suggested_columns = dict(zip(["value_columns", "category_columns"], suggest_columns(profile))) if profile else {}
+
             for column_type, metadata_key in column_types.items():
+                if suggested_columns.get(metadata_key):
+                    st.caption(f"Suggested {column_type.lower()}: {', '.join(suggested_columns[metadata_key])}")
                 selected_columns = st.multiselect(
                     column_type,
                     all_columns,
@@ -247,7 +272,7 @@ def main():
                 )
                 st.session_state.metadata[metadata_key] = list(dict.fromkeys(selected_columns))
                 if selected_columns:
-                    st.table(dfData[selected_columns].head(5))
+                    st.table(dfData.reindex(columns=selected_columns).head(5))
 
             # Automatically populate data_columns
             auto_data_columns = list(set(
@@ -267,7 +292,7 @@ def main():
             )
 
             # Combine auto-populated and additional columns, ensure 'geom' is included
-            st.session_state.metadata["data_columns"] = list(dict.fromkeys(auto_data_columns + additional_columns + ['geom']))
+            st.session_state.metadata["data_columns"] = with_geom(auto_data_columns + additional_columns)
 
             st.write("Final Data Columns:")
             st.write(st.session_state.metadata["data_columns"])
@@ -352,12 +377,7 @@ def main():
                         None
                     )
                     if column_data is None:
-                        column_data = {
-                            "name": column_name,
-                            "label": column_name,
-                            "type": "text",
-                            "description": ""
-                        }
+                        column_data = new_column_entry(column_name, profile)
 
                     st.write(f"**Column:** {column_name}")
                     column_data["label"] = st.text_input(
@@ -420,8 +440,7 @@ def main():
                 else:
                     try:
                         # Ensure 'geom' is included in data_columns
-                        if 'geom' not in st.session_state.metadata["data_columns"]:
-                            st.session_state.metadata["data_columns"].append('geom')
+                        st.session_state.metadata["data_columns"] = with_geom(st.session_state.metadata["data_columns"])
                         
                         # # Display the metadata before saving
                         # st.subheader("Metadata before saving")
@@ -431,7 +450,7 @@ def main():
                             s3,
                             st.session_state.metadata,
                             bucket_name,
-                            'metadata/' + name.split('.')[0] + "_metadata.json"
+                            metadata_key_for(input_file)
                         )
                         st.success("Metadata saved successfully!")
                         
@@ -451,4 +470,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Timings of this rerun, shown with ?perf=1 or PERF_PANEL=1 and logged with PERF_LOG
+    perf_trace = start_page("Metadata Editor")
+    main()
+    show_panel(perf_trace)
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""
+Scaffolding shared by the batch CLIs over every dataset in a bucket
+(metadata_audit.py, dataset_schema.py): the common arguments, a process
+pool whose workers each hold an S3 client, progress on stderr and the
+status summary and JSON report.
+
+A task function runs in a worker and returns a report entry, a dict with
+at least "dataset" and "status" ("error" makes the run fail).
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import boto3
+
+_s3 = None
+
+
+def _init_worker():
+    global _s3
+    # One client per process; clients cannot be shared across processes.
+    # Uses the default AWS credential chain (environment, profile, role).
+    _s3 = boto3.client('s3')
+
+
+def worker_s3():
+    # The S3 client of the current worker process (None outside the pool)
+    return _s3
+
+
+def add_batch_arguments(parser, action):
+    parser.add_argument('--bucket', required=True)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--only', nargs='+', help=f"dataset keys to {action} instead of all of datasets/")
+
+
+def run_pool(function, tasks, workers=None):
+    """
+    Call function(*task) for every task in a process pool, printing progress;
+    returns the report entries in task order.
+    """
+    entries = [None] * len(tasks)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(function, *task): position for position, task in enumerate(tasks)}
+        for done, future in enumerate(as_completed(futures), 1):
+            entry = entries[futures[future]] = future.result()
+            print(f"[{done}/{len(tasks)}] {entry['status']:<16} {entry['dataset']}", file=sys.stderr, flush=True)
+    return entries
+
+
+def summarize(entries):
+    # {status: number of entries}
+    statuses = {}
+    for entry in entries:
+        statuses[entry["status"]] = statuses.get(entry["status"], 0) + 1
+    return statuses
+
+
+def finish(bucket, entries, started, verb, report_path=None, entries_field="datasets"):
+    """
+    Write the JSON report (when `report_path` is set) and print the summary
+    line. Returns the exit status: 1 when any entry failed.
+    """
+    statuses = summarize(entries)
+    seconds = round(time.perf_counter() - started, 1)
+    if report_path:
+        report = {
+            "bucket": bucket,
+            "created": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            "seconds": seconds,
+            "summary": statuses,
+            entries_field: entries,
+        }
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"{verb} {len(entries)} datasets in {seconds} s: "
+          + ", ".join(f"{count} {status}" for status, count in sorted(statuses.items()))
+          + (f". Report: {report_path}" if report_path else ""))
+    return 1 if statuses.get("error") else 0
@@ -0,0 +1,3 @@
+"""
+Performance benchmarks on synthetic data; see benchmarks/run.py.
+"""
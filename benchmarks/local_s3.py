@@ -0,0 +1,130 @@
+"""
+In-process stand-in for the S3 client, holding objects in memory.
+
+It implements the calls the app makes (get_object with Range and
+conditional headers, head_object, put_object, list_objects_v2 and its
+paginator) and raises the same botocore ClientError codes, so the library
+code runs against it unchanged. `latency` adds a fixed delay per request
+to approximate network round trips.
+"""
+import hashlib
+import io
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+LIST_PAGE_SIZE = 1000
+
+
+def _error(code, status, operation, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+
+class LocalBody(io.BytesIO):
+    """
+    Response body with the parts of botocore's StreamingBody the app uses.
+    """
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class LocalPaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.client.list_objects_v2(**kwargs, **({'ContinuationToken': token} if token else {}))
+            yield page
+            if not page['IsTruncated']:
+                return
+            token = page['NextContinuationToken']
+
+
+class LocalS3:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}  # (bucket, key) -> (body, etag, last modified)
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+    def _request(self, operation):
+        with self.lock:
+            self.requests[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _lookup(self, bucket, key, operation):
+        with self.lock:
+            entry = self.objects.get((bucket, key))
+        if entry is None:
+            raise _error('NoSuchKey' if operation == 'GetObject' else '404', 404, operation, key)
+        return entry
+
+    @staticmethod
+    def _check(etag, operation, if_match=None, if_none_match=None):
+        if if_match is not None and if_match != etag:
+            raise _error('PreconditionFailed', 412, operation)
+        if if_none_match is not None and if_none_match in (etag, '*'):
+            if operation == 'PutObject':
+                raise _error('PreconditionFailed', 412, operation)
+            raise _error('304', 304, operation)
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self._request('PutObject')
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        body = bytes(Body.read() if hasattr(Body, 'read') else Body)
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self.lock:
+            current = self.objects.get((Bucket, Key))
+            if IfMatch is not None and (current is None or current[1] != IfMatch):
+                raise _error('PreconditionFailed', 412, 'PutObject')
+            if IfNoneMatch == '*' and current is not None:
+                raise _error('PreconditionFailed', 412, 'PutObject')
+            self.objects[(Bucket, Key)] = (body, etag, datetime.now(timezone.utc))
+        return {'ETag': etag}
+
+    def head_object(self, Bucket, Key, IfMatch=None, IfNoneMatch=None):
+        self._request('HeadObject')
+        body, etag, modified = self._lookup(Bucket, Key, 'HeadObject')
+        self._check(etag, 'HeadObject', IfMatch, IfNoneMatch)
+        return {'ContentLength': len(body), 'ETag': etag, 'LastModified': modified}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, IfNoneMatch=None):
+        self._request('GetObject')
+        body, etag, modified = self._lookup(Bucket, Key, 'GetObject')
+        self._check(etag, 'GetObject', IfMatch, IfNoneMatch)
+        if Range is not None:
+            start, end = Range.split('=', 1)[1].split('-')
+            body = body[int(start):int(end) + 1]
+        return {'Body': LocalBody(body), 'ContentLength': len(body), 'ETag': etag, 'LastModified': modified}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=LIST_PAGE_SIZE):
+        self._request('ListObjectsV2')
+        with self.lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+            start = keys.index(ContinuationToken) if ContinuationToken in keys else 0
+            page = keys[start:start + MaxKeys]
+            contents = [{'Key': key, 'ETag': self.objects[(Bucket, key)][1],
+                         'Size': len(self.objects[(Bucket, key)][0])} for key in page]
+        truncated = start + MaxKeys < len(keys)
+        response = {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': truncated}
+        if truncated:
+            response['NextContinuationToken'] = keys[start + MaxKeys]
+        return response
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(operation_name)
+        return LocalPaginator(self)
@@ -0,0 +1,358 @@
+"""
+Benchmarks of the data tool's hot paths on synthetic data, served from an
+in-process S3 stand-in (benchmarks/local_s3.py).
+
+Run from the repository root:
+
+    python -m benchmarks.run                   # every size, compared with benchmarks/baseline.json if present
+    python -m benchmarks.run --quick           # 10k features only
+    python -m benchmarks.run --save-baseline   # store this run as the new baseline
+    python -m benchmarks.run --only 'render_map/*'
+    python -m benchmarks.run --polygon-sizes 10000 100000 1000000
+
+Polygons stop at 100k features unless asked for more: each cold render of
+1M polygons simplifies every shape again and takes minutes.
+
+Each case is timed as the best of a few runs, with the disk and render
+caches emptied before every run unless the case name ends in "/warm".
+The render_map cases build and serialize the map of a fresh upload's first
+view for each symbology, as render_map does before handing it to st_folium.
+One more run under tracemalloc gives its peak memory, which counts Python
+and NumPy allocations but not Arrow buffers or memory-mapped files.
+
+A case is reported as a regression when its time or peak memory exceeds
+the baseline by more than --tolerance; the exit status is then 1. Baselines
+only compare on the machine and settings they were recorded with, so none
+is committed: record one with --save-baseline on the machine you compare
+on, at the sizes you will run. Without a baseline the results are only
+printed, nothing is compared and the exit status is 0.
+"""
+import argparse
+import fnmatch
+import gc
+import io
+import json
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The benchmark's disk cache must not share (or evict) the app's
+os.environ.setdefault('S3_CACHE_DIR', tempfile.mkdtemp(prefix='benchmark-s3-cache-'))
+
+import streamlit as st
+import streamlit.logger
+
+import Symbology
+from benchmarks import synthetic
+from benchmarks.local_s3 import LocalS3
+from biomass_data import BiomassQuery, build_cube, options, read_biomass_csv, rollup
+from classification import SCHEMES
+from dashboard_store import export_partitioned, load_manifest, read_state, total_row
+from dataset_schema import build_schema, read_schema, write_schema
+from geojson_loader import read_geojson
+from geojson_stream import available_backends, convert_to_dataframe, read_columns, stream_json_file
+from metadata_catalog import INDEX_KEY, MetadataCatalog, index_listing, load_metadata_index, rebuild_metadata_index
+from render_cache import UploadedDataset, render_cache
+from s3_utils import cached_download, list_keys, object_cache
+from spatial_index import HEAT_GRIDS, fit_zoom, viewport
+
+BUCKET = 'benchmark-bucket'
+POINT_SIZES = [10_000, 100_000, 1_000_000]
+POLYGON_SIZES = [10_000, 100_000]
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# Rows converted by the convert_to_dataframe cases, which hold every feature as Python objects
+CONVERT_LIMIT = 100_000
+# Repeats stop early once a case has used this many seconds
+CASE_SECONDS = 20
+
+# (label, symbology, column, options) for every way Symbology.py can draw a layer
+RENDER_MODES = (
+    [("flat", "Flat", None, {}),
+     ("categorized", "Categorized", "category", {})]
+    + [(f"graduated-{style.lower().replace(' ', '-')}", "Graduated", "value",
+        {"graduated_style": style, "scheme": "Quantile", "k": 5}) for style in Symbology.GRADUATED_STYLES]
+    + [(f"graduated-{scheme.split(' (')[0].lower().replace(' ', '-')}", "Graduated", "value",
+        {"graduated_style": "By Color", "scheme": scheme, "k": 5}) for scheme in SCHEMES if scheme != "Quantile"]
+    + [("cluster", "Point Cluster", None, {})]
+    + [(f"heat-{grid.lower()}", "Heat Map", "value", {"grid": grid, "smoothing": 1.0}) for grid in HEAT_GRIDS]
+)
+
+
+def clear_disk_cache():
+    shutil.rmtree(object_cache.directory, ignore_errors=True)
+
+
+def clear_render_caches():
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    with render_cache.lock:
+        render_cache.entries.clear()
+        render_cache.bytes = 0
+
+
+def measure(run, before=None, repeat=3, warmup=False):
+    """
+    {'seconds': best time of up to `repeat` runs, 'peak_mb': peak traced
+    memory of one more}. `before` runs ahead of each run, untimed.
+    """
+    if warmup:
+        run()
+    times = []
+    while len(times) < repeat and sum(times) < CASE_SECONDS:
+        if before:
+            before()
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    if before:
+        before()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'peak_mb': peak / 1024 / 1024, 'runs': len(times)}
+
+
+class Suite:
+    def __init__(self, repeat, only=None):
+        self.repeat = repeat
+        self.only = only
+        self.results = {}
+
+    def case(self, name, run, before=None, warmup=False):
+        if self.only and not any(fnmatch.fnmatch(name, pattern) for pattern in self.only):
+            return
+        result = measure(run, before, self.repeat, warmup)
+        self.results[name] = result
+        print(f"{name:<64} {result['seconds'] * 1000:>11.1f} ms {result['peak_mb']:>10.1f} MB", flush=True)
+
+
+def dataset_key(geometry, size):
+    return f'datasets/synthetic_{geometry}_{size}.json'
+
+
+def populate(s3, args):
+    """
+    Upload the synthetic objects: one GeoJSON per geometry and size, a small
+    dataset and metadata file per catalog layer, biomassData.csv and dict.pkl.
+    """
+    for geometry, sizes in [('point', args.point_sizes), ('polygon', args.polygon_sizes)]:
+        for size in sizes:
+            started = time.perf_counter()
+            s3.put_object(Bucket=BUCKET, Key=dataset_key(geometry, size), Body=synthetic.geojson_bytes(size, geometry))
+            print(f"Generated {geometry} x {size:,} in {time.perf_counter() - started:.1f} s", flush=True)
+    empty = b'{"type":"FeatureCollection","features":[]}'
+    for number in range(args.layers):
+        document = synthetic.metadata_document(number)
+        s3.put_object(Bucket=BUCKET, Key=document['s3_file_path'], Body=empty)
+        s3.put_object(Bucket=BUCKET, Key=f"metadata/{document['layer_id']}_metadata.json",
+                      Body=synthetic.metadata_bytes(number))
+    s3.put_object(Bucket=BUCKET, Key='dashboard/biomassData.csv', Body=synthetic.biomass_csv_bytes(args.biomass_rows))
+    s3.put_object(Bucket=BUCKET, Key='dashboard/dict.pkl', Body=synthetic.dashboard_pickle_bytes(args.dashboard_rows))
+
+
+def bench_geojson(suite, s3, geometry, size):
+    key = dataset_key(geometry, size)
+    label = f'{geometry}-{size}'
+
+    suite.case(f'stream_json_file/{label}/head', lambda: stream_json_file(s3, BUCKET, key), clear_disk_cache)
+    suite.case(f'stream_json_file/{label}/reservoir',
+               lambda: stream_json_file(s3, BUCKET, key, sampling='reservoir', seed=0), clear_disk_cache)
+    sample = stream_json_file(s3, BUCKET, key, limit=CONVERT_LIMIT)
+    suite.case(f'convert_to_dataframe/{label}', lambda: convert_to_dataframe(sample))
+    del sample
+    # The same rows parsed straight into columns, geometries skipped, with every backend installed,
+    # against building whole features first
+    suite.case(f'read_columns/{label}/features',
+               lambda: convert_to_dataframe(stream_json_file(s3, BUCKET, key, limit=CONVERT_LIMIT)), clear_disk_cache)
+    for backend in available_backends():
+        suite.case(f'read_columns/{label}/{backend}',
+                   lambda: read_columns(s3, BUCKET, key, limit=CONVERT_LIMIT, backend=backend), clear_disk_cache)
+
+    # The editor's column listing: one pass building the schema sidecar, then one small GET
+    suite.case(f'dataset_schema/{label}/build', lambda: build_schema(s3, BUCKET, key, download=False))
+    write_schema(s3, BUCKET, build_schema(s3, BUCKET, key, download=False))
+    suite.case(f'dataset_schema/{label}/read', lambda: read_schema(s3, BUCKET, key))
+
+    body = s3.get_object(Bucket=BUCKET, Key=key)['Body'].getvalue()
+    suite.case(f'read_geojson/{label}', lambda: read_geojson(io.BytesIO(body)))
+    dataset = UploadedDataset(label, read_geojson(io.BytesIO(body)))
+    del body
+
+    # The first view of a fresh upload, as render_map opens it: fitted to the data
+    zoom = min(10, fit_zoom(dataset.bounds, Symbology.MAP_WIDTH, Symbology.MAP_HEIGHT))
+    bounds = viewport(dataset.center, zoom, Symbology.MAP_WIDTH, Symbology.MAP_HEIGHT)
+    for mode, symbology, column, options in RENDER_MODES:
+        def render():
+            m, _ = Symbology.build_map(dataset, symbology, column, options, dataset.center, zoom, bounds)
+            # The page st_folium ships, layer data included
+            return m.get_root().render()
+        suite.case(f'render_map/{label}/{mode}/cold', render, clear_render_caches)
+        # Indexes and classifications kept, as on a pan or a switch of mode
+        suite.case(f'render_map/{label}/{mode}/warm', render, warmup=True)
+    clear_render_caches()
+
+
+def bench_metadata(suite, s3, layers):
+    suite.case(f'list_files_in_folder/datasets-{layers}', lambda: list_keys(s3, BUCKET, 'datasets/'))
+
+    def drop_index():
+        s3.objects.pop((BUCKET, INDEX_KEY), None)
+    suite.case(f'explore/rebuild_metadata_index/{layers}', lambda: rebuild_metadata_index(s3, BUCKET), drop_index)
+    rebuild_metadata_index(s3, BUCKET)
+    suite.case(f'explore/load_metadata_index/{layers}', lambda: load_metadata_index(s3, BUCKET))
+
+    # The fan-out the explore page runs for fields the index does not summarize
+    def refresh_catalog():
+        index = load_metadata_index(s3, BUCKET)
+        return MetadataCatalog().refresh(s3, BUCKET, listing=index_listing(index))
+    suite.case(f'explore/catalog_refresh/{layers}', refresh_catalog)
+
+
+def residue_views(cube):
+    # The aggregations pages/Residue.py draws with its default selections
+    totals = rollup(cube, ['State', 'Source']).pivot(index='State', columns='Source', values='Biomas Tons')
+    totals.loc['Total'] = totals.sum(numeric_only=True)
+    query = (BiomassQuery(cube)
+             .where_in('Source', [options(cube['Source'])[0]])
+             .where_in('State', [options(cube['State'])[0]]))
+    for column in ['Biomass Sector', 'Biomass Commodity', 'Biomass Type']:
+        query = query.where_in(column, query.distinct(column))
+    total = query.total(having=False)
+    filtered = query.having_min('County', 0).rows()
+    grouped = rollup(filtered, ['State']).sort_values(by='Biomas Tons', ascending=False)
+    counties = rollup(filtered, ['County']).sort_values(by='Biomas Tons', ascending=False)
+    return totals, total, grouped, counties.head(5)
+
+
+def bench_residue(suite, s3, rows):
+    def load():
+        buffer, _ = cached_download(s3, BUCKET, 'dashboard/biomassData.csv')
+        return read_biomass_csv(buffer)
+    suite.case(f'residue/load/{rows}', load, clear_disk_cache)
+    df = load()
+    suite.case(f'residue/build_cube/{rows}', lambda: build_cube(df))
+    cube = build_cube(df)
+    suite.case(f'residue/aggregate/{rows}', lambda: residue_views(cube))
+
+
+def bench_infrastructure(suite, s3, rows):
+    def load_pickle():
+        buffer, _ = cached_download(s3, BUCKET, 'dashboard/dict.pkl')
+        return pickle.loads(buffer)
+    suite.case(f'infrastructure/load_dict_pkl/{rows}', load_pickle, clear_disk_cache)
+    data_dict = load_pickle()
+    suite.case(f'infrastructure/export/{rows}', lambda: export_partitioned(data_dict, s3, BUCKET))
+
+    def load_state():
+        manifest = load_manifest(s3, BUCKET)
+        state = manifest['states'][0]
+        frames = read_state(s3, BUCKET, manifest, state)
+        return {name: total_row(manifest, name, state, df) for name, df in frames.items() if len(df) > 1}
+    suite.case(f'infrastructure/load_state/{rows}', load_state, clear_disk_cache)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print each case against the baseline and return the names of regressions.
+    Differences under 5 ms or 1 MB are treated as noise.
+    """
+    regressions = []
+    print(f"\n{'case':<64} {'time':>9} {'memory':>9}")
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<64} {'new':>9} {'new':>9}")
+            continue
+        time_ratio = result['seconds'] / previous['seconds'] if previous['seconds'] else 1.0
+        memory_ratio = result['peak_mb'] / previous['peak_mb'] if previous['peak_mb'] else 1.0
+        slower = time_ratio > 1 + tolerance and result['seconds'] - previous['seconds'] > 0.005
+        larger = memory_ratio > 1 + tolerance and result['peak_mb'] - previous['peak_mb'] > 1
+        flag = '  REGRESSION' if slower or larger else ''
+        print(f"{name:<64} {time_ratio:>8.2f}x {memory_ratio:>8.2f}x{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data tool on synthetic data.")
+    parser.add_argument('--point-sizes', type=int, nargs='*', default=POINT_SIZES, help="point GeoJSON feature counts")
+    parser.add_argument('--polygon-sizes', type=int, nargs='*', default=POLYGON_SIZES,
+                        help="polygon GeoJSON feature counts")
+    parser.add_argument('--quick', action='store_true', help="only the smallest size (10k features)")
+    parser.add_argument('--layers', type=int, default=2000, help="metadata files in the catalog")
+    parser.add_argument('--biomass-rows', type=int, default=500_000)
+    parser.add_argument('--dashboard-rows', type=int, default=100_000, help="rows per dict.pkl table")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every S3 request")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', help="glob patterns of the cases to run")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="write the results to --baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown or growth, as a fraction")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+    # Cached functions called outside `streamlit run` warn on every call
+    streamlit.logger.set_log_level('error')
+    if args.quick:
+        args.point_sizes = args.polygon_sizes = [10_000]
+
+    config = {name: getattr(args, name) for name in
+              ['point_sizes', 'polygon_sizes', 'layers', 'biomass_rows', 'dashboard_rows', 'latency', 'repeat']}
+    s3 = LocalS3(latency=args.latency)
+    populate(s3, args)
+
+    suite = Suite(args.repeat, args.only)
+    try:
+        bench_metadata(suite, s3, args.layers)
+        bench_residue(suite, s3, args.biomass_rows)
+        bench_infrastructure(suite, s3, args.dashboard_rows)
+        for geometry, sizes in [('point', args.point_sizes), ('polygon', args.polygon_sizes)]:
+            for size in sizes:
+                bench_geojson(suite, s3, geometry, size)
+    finally:
+        clear_disk_cache()
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'config': config,
+        'cases': suite.results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    status = 0
+    if not os.path.exists(args.baseline) and not args.save_baseline:
+        print(f"\nNo baseline at {args.baseline}, so nothing was compared. "
+              f"Record one on this machine with --save-baseline.")
+    elif not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            print(f"\nNote: {args.baseline} was recorded with other settings: {baseline.get('config')}")
+        regressions = compare(suite.results, baseline['cases'], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            status = 1
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"\nSaved the baseline to {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
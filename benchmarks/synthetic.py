@@ -0,0 +1,147 @@
+"""
+Synthetic stand-ins for the bucket's datasets, generated from a seed so
+every run measures the same bytes.
+"""
+import json
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# Rough continental US extent, (west, south, east, north)
+EXTENT = (-125.0, 25.0, -67.0, 49.0)
+STATES = [f"State {number:02d}" for number in range(50)]
+CATEGORIES = ["Sawmill", "Pulp", "Biomass", "Pellet", "Veneer", "Chip", "Panel", "Other"]
+SOURCES = ["Agriculture", "Forestry", "Urban", "Energy Crops"]
+SECTORS = ["Crop Residue", "Logging Residue", "Mill Residue", "Municipal Waste"]
+COMMODITIES = [f"Commodity {number}" for number in range(30)]
+TYPES = ["Primary", "Secondary", "Tertiary"]
+COUNTIES_PER_STATE = 60
+
+
+def _positions(n, rng, clusters=40):
+    # Features bunch around towns, as in the real layers, rather than spreading evenly
+    west, south, east, north = EXTENT
+    centers = np.column_stack([rng.uniform(west, east, clusters), rng.uniform(south, north, clusters)])
+    picked = centers[rng.integers(0, clusters, n)]
+    lon = np.clip(picked[:, 0] + rng.normal(0, 1.5, n), west, east)
+    lat = np.clip(picked[:, 1] + rng.normal(0, 1.0, n), south, north)
+    return lon, lat
+
+
+def _ring(lon, lat, rng):
+    # A closed, star-shaped ring of 6 to 12 vertices around (lon, lat)
+    count = int(rng.integers(6, 13))
+    angles = np.sort(rng.uniform(0, 2 * np.pi, count))
+    radii = rng.uniform(0.005, 0.05, count)
+    xs = np.round(lon + radii * np.cos(angles), 6)
+    ys = np.round(lat + radii * np.sin(angles), 6)
+    points = [f"[{x},{y}]" for x, y in zip(xs, ys)]
+    return "[" + ",".join(points + points[:1]) + "]"
+
+
+def geojson_bytes(n, geometry='point', seed=0):
+    """
+    A FeatureCollection of `n` point or polygon features, encoded as UTF-8.
+
+    Properties: an integer id, a state name, a category, a float value
+    (missing for 1% of the features) and an integer count.
+    """
+    rng = np.random.default_rng(seed)
+    lon, lat = _positions(n, rng)
+    lon, lat = np.round(lon, 6), np.round(lat, 6)
+    states = rng.integers(0, len(STATES), n)
+    categories = rng.integers(0, len(CATEGORIES), n)
+    values = np.round(rng.lognormal(3, 1, n), 3)
+    missing = rng.random(n) < 0.01
+    counts = rng.integers(0, 1000, n)
+
+    features = []
+    for i in range(n):
+        if geometry == 'point':
+            geom = f'{{"type":"Point","coordinates":[{lon[i]},{lat[i]}]}}'
+        else:
+            geom = f'{{"type":"Polygon","coordinates":[{_ring(lon[i], lat[i], rng)}]}}'
+        value = 'null' if missing[i] else values[i]
+        features.append(
+            f'{{"type":"Feature","geometry":{geom},"properties":{{"id":{i},'
+            f'"state_name":"{STATES[states[i]]}","category":"{CATEGORIES[categories[i]]}",'
+            f'"value":{value},"count":{counts[i]}}}}}'
+        )
+    return ('{"type":"FeatureCollection","features":[' + ",".join(features) + ']}').encode('utf-8')
+
+
+def biomass_csv_bytes(rows, seed=0):
+    """
+    biomassData.csv with the column names the Residue page expects.
+    """
+    rng = np.random.default_rng(seed)
+    states = rng.integers(0, len(STATES), rows)
+    frame = pd.DataFrame({
+        'state': np.array(STATES)[states],
+        'source': rng.choice(SOURCES, rows),
+        'county': [f"County {state:02d}-{county:02d}"
+                   for state, county in zip(states, rng.integers(0, COUNTIES_PER_STATE, rows))],
+        'biomass_sector': rng.choice(SECTORS, rows),
+        'biomass_commodity': rng.choice(COMMODITIES, rows),
+        'biomass_type': rng.choice(TYPES, rows),
+        'biomas_tons': np.round(rng.lognormal(6, 1.5, rows), 2),
+    })
+    return frame.to_csv(index=False).encode('utf-8')
+
+
+def dashboard_dict(rows, tables=8, seed=0):
+    """
+    The {table name: DataFrame} dictionary pickled as dashboard/dict.pkl.
+    Every table but the last has a state_name column.
+    """
+    rng = np.random.default_rng(seed)
+    data_dict = {}
+    for number in range(tables):
+        frame = pd.DataFrame({
+            'facility': [f"Facility {number}-{row}" for row in range(rows)],
+            'capacity': rng.integers(0, 10000, rows),
+            'output_tons': np.round(rng.lognormal(5, 1, rows), 2),
+            'utilization': np.round(rng.random(rows), 3),
+        })
+        if number < tables - 1:
+            frame.insert(0, 'state_name', rng.choice(STATES, rows))
+        data_dict[f"Table {number}"] = frame
+    return data_dict
+
+
+def dashboard_pickle_bytes(rows, tables=8, seed=0):
+    return pickle.dumps(dashboard_dict(rows, tables, seed))
+
+
+def metadata_document(number):
+    """
+    One layer's metadata file, shaped like those under metadata/.
+    """
+    layer_id = f"layer_{number:04d}"
+    columns = [
+        {"name": "value", "label": "Value", "type": "float", "description": "Synthetic value"},
+        {"name": "category", "label": "Category", "type": "string", "description": "Synthetic category"},
+        {"name": "state_name", "label": "State", "type": "string", "description": "State name"},
+    ]
+    return {
+        "name": f"Layer {number}",
+        "layer_id": layer_id,
+        "geom_type": "point" if number % 2 else "polygon",
+        "geom_join": "",
+        "description": f"Synthetic layer {number}",
+        "has_biomass": bool(number % 3 == 0),
+        "value_columns": ["value"],
+        "category_columns": ["category"],
+        "details_columns": ["id", "state_name", "category", "value"],
+        "data_columns": ["id", "state_name", "category", "value", "count", "geom"],
+        "s3_file_path": f"datasets/{layer_id}.json",
+        "view_name": f"{layer_id}_view",
+        "layer_access_level": "public",
+        "updated_at": "2024-09-16 19:42:58",
+        "columns": columns,
+    }
+
+
+def metadata_bytes(number):
+    return json.dumps(metadata_document(number), indent=2).encode('utf-8')
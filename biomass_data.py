@@ -0,0 +1,201 @@
+"""
+Loading and filtering helpers for the biomass residue dashboard
+(dashboard/biomassData.csv).
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+import perf
+from s3_utils import BufferReader
+
+# Low-cardinality text columns, stored as pandas categoricals in typed mode
+CATEGORY_COLUMNS = ['State', 'Source', 'County', 'Biomass Sector', 'Biomass Commodity', 'Biomass Type']
+TONS_COLUMN = 'Biomas Tons'
+
+
+def column_label(name):
+    return name.title().replace('_', ' ')
+
+
+def downcast_numeric(df):
+    """
+    Shrink integer columns (ids, counts) to the smallest dtype that holds
+    them. Float columns stay float64: the tons are summed, and float32 would
+    change the displayed totals in their last digits.
+    """
+    for column in df.select_dtypes(include='integer').columns:
+        df[column] = pd.to_numeric(df[column], downcast='integer')
+    return df
+
+
+@perf.timed('parse.read_biomass_csv')
+def read_biomass_csv(buffer, typed=True):
+    """
+    Parse biomassData.csv from a buffer, with display column names and tons
+    converted to thousands.
+
+    With `typed`, the CATEGORY_COLUMNS are parsed straight into categoricals
+    (never materialized as Python strings) and integer columns are downcast,
+    which cuts resident memory several times over.
+    """
+    dtype = None
+    if typed:
+        header = pd.read_csv(BufferReader(buffer), nrows=0).columns
+        dtype = {name: 'category' for name in header if column_label(name) in CATEGORY_COLUMNS}
+    df = pd.read_csv(BufferReader(buffer), dtype=dtype)
+    df.columns = [column_label(col) for col in df.columns]
+    df[TONS_COLUMN] /= 1000  # Convert Biomass Tons to Thousands
+    if typed:
+        downcast_numeric(df)
+    return df
+
+
+def options(series):
+    """
+    Distinct values in order of appearance, for sidebar widgets.
+    """
+    return list(series.unique())
+
+
+def isin_codes(series, values):
+    """
+    Boolean mask of `series` values in `values`, matching missing values when
+    `values` holds one, like Series.isin. For categoricals the test runs on
+    the integer category codes instead of the values.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.isin(values).to_numpy()
+    values = list(values)
+    codes = series.cat.categories.get_indexer(values)
+    mask = np.isin(series.cat.codes.to_numpy(), codes[codes >= 0])
+    if any(pd.isna(value) for value in values):
+        # Missing values have code -1, which is no category
+        mask |= series.isna().to_numpy()
+    return mask
+
+
+@perf.timed('aggregate.build_cube')
+def build_cube(df, dimensions=CATEGORY_COLUMNS):
+    """
+    Sum tons over every distinct State x County x Source x Sector x Commodity
+    x Type combination. Everything the dashboard shows is a roll-up of this,
+    so its cost depends on the number of groups rather than raw rows. Rows
+    with missing dimension values are kept so totals still match.
+    """
+    dimensions = [column for column in dimensions if column in df.columns]
+    return df.groupby(dimensions, observed=True, sort=False, dropna=False)[TONS_COLUMN].sum().reset_index()
+
+
+@perf.timed('aggregate.rollup')
+def rollup(cube, by):
+    """
+    Total tons grouped by `by`, a subset of the cube dimensions.
+    """
+    return cube.groupby(by, observed=True)[TONS_COLUMN].sum().reset_index()
+
+
+def _codes(series):
+    # Integer group codes (-1 for missing) and the number of groups
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), len(series.cat.categories)
+    codes, uniques = pd.factorize(series)
+    return codes, len(uniques)
+
+
+class BiomassQuery:
+    """
+    Lazy filter over the cube (or raw rows).
+
+    `where_in` collects row predicates and `having_min` group-level minimums
+    on total tons. Nothing is evaluated until a result is asked for; then the
+    predicates are combined into a single boolean mask, each HAVING condition
+    costs one bincount over the group codes, and only the final rows are
+    materialized (`rows`), or just located (`positions`). `explain` reports
+    each step's selectivity and time.
+    """
+
+    def __init__(self, frame, value_column=TONS_COLUMN):
+        self.frame = frame
+        self.value_column = value_column
+        self.predicates = []
+        self.having = []
+        self._where_mask = None
+        self._applied = 0
+        self._mask = None
+        self.steps = []
+
+    def where_in(self, column, values):
+        self.predicates.append((column, list(values)))
+        self._mask = None
+        return self
+
+    def having_min(self, column, minimum):
+        self.having.append((column, minimum))
+        self._mask = None
+        return self
+
+    def _timed(self, description, started, mask):
+        seconds = time.perf_counter() - started
+        rows = int(mask.sum())
+        self.steps.append((description, rows, seconds * 1000))
+        perf.record('aggregate.query', started, seconds, step=description, rows=rows)
+
+    def where_mask(self):
+        # Predicates added after an evaluation are ANDed onto the existing mask
+        if self._where_mask is None:
+            self._where_mask = np.ones(len(self.frame), dtype=bool)
+        for column, values in self.predicates[self._applied:]:
+            started = time.perf_counter()
+            self._where_mask &= isin_codes(self.frame[column], values)
+            self._timed(f"WHERE {column} IN ({len(values)} values)", started, self._where_mask)
+        self._applied = len(self.predicates)
+        return self._where_mask
+
+    def mask(self):
+        if self._mask is None:
+            mask = self.where_mask().copy()
+            values = self.frame[self.value_column].to_numpy()
+            for column, minimum in self.having:
+                started = time.perf_counter()
+                codes, groups = _codes(self.frame[column])
+                selected = mask & (codes >= 0)
+                totals = np.bincount(codes[selected], weights=values[selected], minlength=groups)
+                mask = selected & (totals >= minimum)[np.where(codes >= 0, codes, 0)]
+                self._timed(f"HAVING sum({self.value_column}) >= {minimum} BY {column}", started, mask)
+            self._mask = mask
+        return self._mask
+
+    def distinct(self, column, having=False):
+        """
+        Distinct values of `column` among the matching rows, in order of appearance.
+        """
+        mask = self.mask() if having else self.where_mask()
+        return options(self.frame[column][mask])
+
+    def total(self, having=True):
+        mask = self.mask() if having else self.where_mask()
+        return self.frame[self.value_column].to_numpy()[mask].sum()
+
+    def positions(self):
+        """
+        Integer positions of the matching rows in the frame, without copying them.
+        """
+        return np.flatnonzero(self.mask())
+
+    def rows(self):
+        """
+        The matching rows, as a new frame: a boolean selection copies them.
+        Use `positions` to locate them without a copy.
+        """
+        started = time.perf_counter()
+        mask = self.mask()
+        rows = self.frame[mask]
+        self._timed("materialize rows", started, mask)
+        return rows
+
+    def explain(self):
+        lines = [f"{len(self.frame)} input rows"]
+        lines += [f"{description}: {rows} rows, {ms:.2f} ms" for description, rows, ms in self.steps]
+        return "\n".join(lines)
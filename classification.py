@@ -0,0 +1,168 @@
+"""
+Vectorized classification of a column into map classes: class indices, a
+color lookup table and legend entries, computed in one pass.
+"""
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from map_layers import hex_palette
+
+SCHEMES = ["Equal Interval", "Quantile", "Standard Deviation", "Natural Breaks (Jenks)"]
+# Jenks is quadratic in the number of values, so it runs on a sample
+JENKS_SAMPLE = 2000
+# Class ends whose segment costs Jenks evaluates at once, bounding its memory
+JENKS_BLOCK = 128
+NO_DATA_COLOR = '#bdbdbd'
+
+
+class Classification:
+    """
+    `classes` holds each feature's index into `palette` and `labels`. Missing
+    values get a "No data" class of their own after the `k` value classes.
+    """
+
+    def __init__(self, classes, palette, labels, breaks=None):
+        self.classes = classes
+        self.palette = palette
+        self.labels = labels
+        self.breaks = breaks
+        self.counts = np.bincount(classes, minlength=len(palette))
+
+    @property
+    def k(self):
+        # Number of classes, not counting "No data"
+        return len(self.breaks) if self.breaks is not None else len(self.palette)
+
+    def legend(self):
+        """
+        (color, label) pairs, with the feature count of each class.
+        """
+        return [(color, f"{label} ({count})") for color, label, count in zip(self.palette, self.labels, self.counts)]
+
+
+def equal_interval_breaks(values, k):
+    return np.linspace(values.min(), values.max(), k + 1)[1:]
+
+
+def quantile_breaks(values, k):
+    return np.quantile(values, np.linspace(0, 1, k + 1)[1:])
+
+
+def std_dev_breaks(values, k):
+    """
+    Classes one standard deviation wide, centered on the mean.
+    """
+    std = values.std()
+    if std == 0:
+        return np.array([values.max()])
+    inner = values.mean() + std * (np.arange(1, k) - k / 2)
+    inner = inner[(inner > values.min()) & (inner < values.max())]
+    return np.append(inner, values.max())
+
+
+def _sample(values, size, seed):
+    if len(values) <= size:
+        return values
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(values, size - 2, replace=False)
+    # Keep the extremes so the breaks cover the whole range
+    return np.concatenate([sample, [values.min(), values.max()]])
+
+
+def _ssd(s1, s2, i, j):
+    """
+    Squared deviation of one class holding values[i..j] (inf when i > j),
+    from the prefix sums of the sorted values and of their squares.
+    """
+    count = j - i + 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ssd = s2[j + 1] - s2[i] - (s1[j + 1] - s1[i]) ** 2 / count
+    return np.where(count > 0, ssd, np.inf)
+
+
+def jenks_breaks(values, k, sample_size=JENKS_SAMPLE, seed=0):
+    """
+    Fisher-Jenks natural breaks: the k classes with the least total squared
+    deviation from their class means, found by dynamic programming over the
+    sorted (sampled) values. Memory is O(k * n): segment costs come from
+    prefix sums, JENKS_BLOCK class ends at a time.
+    """
+    values = np.sort(_sample(values, sample_size, seed))
+    n = len(values)
+    k = min(k, len(np.unique(values)))
+    s1 = np.concatenate([[0.0], np.cumsum(values)])
+    s2 = np.concatenate([[0.0], np.cumsum(values ** 2)])
+
+    cost = _ssd(s1, s2, 0, np.arange(n))
+    starts = []
+    i = np.arange(1, n)[:, None]
+    for _ in range(1, k):
+        # Best split of values[0..j] with the last class starting at i
+        start = np.empty(n, dtype=np.intp)
+        best = np.empty(n)
+        for lo in range(0, n, JENKS_BLOCK):
+            j = np.arange(lo, min(lo + JENKS_BLOCK, n))
+            total = np.full((n, len(j)), np.inf)
+            total[1:] = cost[:-1, None] + _ssd(s1, s2, i, j[None, :])
+            start[j] = total.argmin(axis=0)
+            best[j] = total[start[j], np.arange(len(j))]
+        starts.append(start)
+        cost = best
+
+    breaks = [values[-1]]
+    end = n - 1
+    for start in reversed(starts):
+        end = start[end] - 1
+        breaks.append(values[end])
+    return np.array(breaks[::-1])
+
+
+BREAKS = {
+    "Equal Interval": equal_interval_breaks,
+    "Quantile": quantile_breaks,
+    "Standard Deviation": std_dev_breaks,
+    "Natural Breaks (Jenks)": jenks_breaks,
+}
+
+
+def _format(value):
+    return f"{value:,.6g}"
+
+
+def classify(values, scheme, k, cmap='RdYlGn_r'):
+    """
+    Split numeric `values` into at most `k` classes with `scheme` (one of
+    SCHEMES). A class holds the values above the previous break up to and
+    including its own. Fewer classes are returned when the breaks coincide.
+    """
+    if scheme not in BREAKS:
+        raise ValueError(f"Unknown classification scheme {scheme!r}, expected one of {SCHEMES}")
+    values = np.asarray(values, dtype=float)
+    missing = np.isnan(values)
+    present = values[~missing]
+    if not len(present):
+        return Classification(np.zeros(len(values), dtype=int), [NO_DATA_COLOR], ["No data"], np.array([]))
+
+    breaks = np.unique(BREAKS[scheme](present, k))
+    breaks[-1] = present.max()
+    classes = np.minimum(np.searchsorted(breaks, values, side='left'), len(breaks) - 1)
+    palette = hex_palette(plt.get_cmap(cmap)(np.linspace(0, 1, len(breaks))))
+    lower = np.concatenate([[present.min()], breaks[:-1]])
+    labels = [f"{_format(low)} – {_format(high)}" for low, high in zip(lower, breaks)]
+    if missing.any():
+        classes[missing] = len(breaks)
+        palette.append(NO_DATA_COLOR)
+        labels.append("No data")
+    return Classification(classes, palette, labels, breaks)
+
+
+def categorize(values, cmap='Set1'):
+    """
+    One class per distinct value, in order of appearance. Missing values
+    form a class of their own.
+    """
+    codes, categories = pd.factorize(pd.Series(values), use_na_sentinel=False)
+    palette = hex_palette(plt.get_cmap(cmap, max(len(categories), 1))(np.arange(len(categories))))
+    labels = ["No data" if pd.isna(category) else str(category) for category in categories]
+    return Classification(codes, palette, labels)
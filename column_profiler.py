@@ -0,0 +1,208 @@
+import json
+import math
+from decimal import Decimal
+
+import ijson
+
+import perf
+from s3_utils import open_object
+
+MASK64 = (1 << 64) - 1
+
+# Thresholds used when suggesting value/category columns
+CATEGORY_MAX_DISTINCT = 50
+ID_SUFFIXES = ("_id", "geoid", "fips")
+
+
+def _hash64(value):
+    # Python's hash() is cheap but poorly mixed for ints; finish it with splitmix64
+    try:
+        x = hash(value) & MASK64
+    except TypeError:
+        x = hash(json.dumps(value, sort_keys=True, default=str)) & MASK64
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+class HyperLogLog:
+    """
+    Approximate distinct counter in 2**p bytes (about 1.6% error at p=12).
+    """
+
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        x = _hash64(value)
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is far more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class FrequentItems:
+    """
+    Misra-Gries heavy hitters: keeps at most `capacity` counters, and every
+    value seen more than n / capacity times is guaranteed to be among them.
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.counters = {}
+
+    def add(self, item):
+        counters = self.counters
+        if item in counters:
+            counters[item] += 1
+        elif len(counters) < self.capacity:
+            counters[item] = 1
+        else:
+            for key in list(counters):
+                counters[key] -= 1
+                if counters[key] == 0:
+                    del counters[key]
+
+    def top(self, k):
+        return sorted(self.counters.items(), key=lambda item: -item[1])[:k]
+
+
+class ColumnProfile:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.kinds = set()
+        self.min = None
+        self.max = None
+        self.distinct = HyperLogLog()
+        self.frequent = FrequentItems()
+
+    def add(self, value):
+        if value is None:
+            return
+        self.count += 1
+        if isinstance(value, bool):
+            self.kinds.add("boolean")
+        elif isinstance(value, int):
+            self.kinds.add("int")
+        elif isinstance(value, (float, Decimal)):
+            self.kinds.add("float")
+        else:
+            self.kinds.add("text")
+
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, sort_keys=True, default=str)
+        self.distinct.add(value)
+        self.frequent.add(value)
+
+    @property
+    def type(self):
+        if not self.kinds:
+            return "text"
+        if len(self.kinds) == 1:
+            return next(iter(self.kinds))
+        if self.kinds == {"int", "float"}:
+            return "float"
+        return "text"
+
+    def summary(self, feature_count, top_k=5):
+        return {
+            "type": self.type,
+            "count": self.count,
+            "nulls": feature_count - self.count,
+            "min": float(self.min) if self.min is not None else None,
+            "max": float(self.max) if self.max is not None else None,
+            "distinct": min(self.distinct.count(), self.count),
+            "top": [[_plain(value), count] for value, count in self.frequent.top(top_k)],
+        }
+
+
+def _plain(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+
+def profile_properties(properties_iter, top_k=5):
+    """
+    Profile an iterable of feature `properties` dicts in a single pass.
+
+    Memory is bounded by the number of columns, not the number of features.
+    Returns {"feature_count": n, "columns": {name: summary}} with columns in
+    order of first appearance; `nulls` counts both null and absent values.
+    """
+    columns = {}
+    feature_count = 0
+    for properties in properties_iter:
+        feature_count += 1
+        for name, value in (properties or {}).items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = ColumnProfile(name)
+            column.add(value)
+
+    return {
+        "feature_count": feature_count,
+        "columns": {name: column.summary(feature_count, top_k) for name, column in columns.items()},
+    }
+
+
+def profile_geojson(s3, bucket, key, top_k=5):
+    """
+    Stream every feature of a GeoJSON object in S3 (read through the disk
+    cache) through `profile_properties`.
+
+    Only the `properties` of each feature are built into Python objects; the
+    geometry is tokenized but never materialized.
+    """
+    body, etag = open_object(s3, bucket, key)
+    with perf.span('parse.profile_geojson', key=key) as span:
+        try:
+            properties = ijson.items(body, 'features.item.properties')
+            profile = profile_properties(properties, top_k)
+        finally:
+            body.close()
+        span.set(features=profile["feature_count"])
+    profile["etag"] = etag
+    return profile
+
+
+def suggest_columns(profile):
+    """
+    Suggest (value_columns, category_columns) from a profile.
+
+    Value columns are numeric and not identifiers; category columns are
+    low-cardinality text or integer columns.
+    """
+    value_columns = []
+    category_columns = []
+    for name, column in profile["columns"].items():
+        if name in ("geom", "geometry") or not column["count"]:
+            continue
+        looks_like_id = name.lower() == "id" or name.lower().endswith(ID_SUFFIXES)
+        low_cardinality = column["distinct"] <= CATEGORY_MAX_DISTINCT and column["distinct"] < column["count"]
+        if column["type"] == "float" and not looks_like_id:
+            value_columns.append(name)
+        elif column["type"] == "int" and not looks_like_id and not low_cardinality:
+            value_columns.append(name)
+        elif column["type"] in ("text", "int", "boolean") and low_cardinality and not looks_like_id:
+            category_columns.append(name)
+    return value_columns, category_columns
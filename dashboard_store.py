@@ -0,0 +1,242 @@
+"""
+State-partitioned columnar store for the dashboard tables (dashboard/dict.pkl).
+
+Each table is split by state into uncompressed Arrow IPC files, so a page
+reads only the selected state's partitions and maps them from the local disk
+cache instead of unpickling every table. A small manifest lists the tables,
+states and partition keys, along with each state's numeric totals and the
+ETag of the pickle it was converted from, so a store older than the pickle
+can be told apart.
+
+Convert the pickle once with:
+
+    python dashboard_store.py --bucket dev-data-layer-datasets --source dashboard/dict.pkl
+"""
+import argparse
+import json
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+from botocore.exceptions import ClientError
+
+import perf
+from s3_utils import cached_download
+
+SOURCE_KEY = 'dashboard/dict.pkl'
+STORE_PREFIX = 'dashboard/dict_store/'
+STATE_COLUMN = 'state_name'
+STORE_VERSION = 1
+
+
+def _to_arrow(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Object columns mixing types cannot be typed by Arrow; store them as text
+        df = df.copy()
+        for column in df.columns[df.dtypes == object]:
+            df[column] = df[column].map(lambda value: value if value is None else str(value))
+        return pa.Table.from_pandas(df, preserve_index=True)
+
+
+def _ipc_bytes(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def state_totals(df, state_column=STATE_COLUMN):
+    """
+    Sum the numeric columns of every state with one groupby.
+
+    Returns {state: {column: total}} for the states with more than one row,
+    the only ones the dashboard shows a "Total" row for.
+    """
+    numeric_columns = df.select_dtypes(include=['float', 'int']).columns
+    grouped = df.groupby(state_column, sort=False)
+    sizes = grouped.size()
+    sums = grouped[list(numeric_columns)].sum()
+    return {
+        state: {column: value.item() if hasattr(value, 'item') else value for column, value in row.items()}
+        for state, row in sums[sizes > 1].iterrows()
+    }
+
+
+def export_partitioned(data_dict, s3, bucket, prefix=STORE_PREFIX, state_column=STATE_COLUMN, source_etag=None):
+    """
+    Write every DataFrame of `data_dict` as one Arrow file per state, then the
+    manifest. Tables without `state_column` are stored as a single partition.
+    `source_etag` is the ETag of the pickle `data_dict` was read from.
+    Returns the manifest.
+    """
+    first = next(iter(data_dict.values()))
+    states = [state for state in pd.unique(first[state_column]) if not pd.isna(state)]
+
+    tables = {}
+    for number, (name, df) in enumerate(data_dict.items()):
+        table_prefix = f'{prefix}table-{number:03d}/'
+        partitions = {}
+        if state_column in df.columns:
+            groups = {state: rows for state, rows in df.groupby(state_column, sort=False)}
+            totals = state_totals(df, state_column)
+            for position, state in enumerate(states):
+                # Every state gets a partition, even an empty one, so it keeps the schema
+                rows = groups.get(state, df.iloc[0:0])
+                key = f'{table_prefix}part-{position:03d}.arrow'
+                s3.put_object(Body=_ipc_bytes(_to_arrow(rows)).to_pybytes(), Bucket=bucket, Key=key)
+                partitions[str(state)] = {'key': key, 'rows': len(rows)}
+                if state in totals:
+                    partitions[str(state)]['totals'] = totals[state]
+        else:
+            key = f'{table_prefix}all.arrow'
+            s3.put_object(Body=_ipc_bytes(_to_arrow(df)).to_pybytes(), Bucket=bucket, Key=key)
+        tables[str(name)] = {
+            'partitioned': state_column in df.columns,
+            'key': None if state_column in df.columns else key,
+            'rows': len(df),
+            'partitions': partitions,
+        }
+
+    manifest = {
+        'version': STORE_VERSION,
+        'source_etag': source_etag,
+        'state_column': state_column,
+        'states': [str(state) for state in states],
+        'tables': tables,
+    }
+    s3.put_object(Body=json.dumps(manifest, indent=1), Bucket=bucket, Key=prefix + 'manifest.json',
+                  ContentType='application/json')
+    return manifest
+
+
+def load_manifest(s3, bucket, prefix=STORE_PREFIX):
+    buffer, stats = cached_download(s3, bucket, prefix + 'manifest.json')
+    manifest = json.loads(bytes(buffer))
+    if manifest.get('version') != STORE_VERSION:
+        raise ValueError(f"Unsupported dashboard store version {manifest.get('version')}")
+    # Identifies this export, e.g. for caching what was read from it
+    manifest['etag'] = stats['etag']
+    return manifest
+
+
+def store_status(s3, bucket, prefix=STORE_PREFIX, source_key=SOURCE_KEY):
+    """
+    Return (manifest, problem): the manifest when the store can be read and was
+    converted from the current `source_key` pickle, else None and why not.
+    When the pickle itself is gone, the store is all there is and is used.
+    """
+    try:
+        manifest = load_manifest(s3, bucket, prefix)
+    except Exception as e:
+        return None, f"The dashboard store could not be read ({e})."
+    try:
+        source_etag = s3.head_object(Bucket=bucket, Key=source_key)['ETag']
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return manifest, None
+        raise
+    if manifest.get('source_etag') != source_etag:
+        return None, f"The dashboard store was not converted from the current {source_key}."
+    return manifest, None
+
+
+def read_source(s3, bucket, key=SOURCE_KEY):
+    """
+    Return the {table name: DataFrame} pickle the store is converted from.
+    """
+    buffer, _ = cached_download(s3, bucket, key)
+    # The pickle is our own export
+    with perf.span('parse.read_source', key=key):
+        return pickle.loads(buffer)
+
+
+def source_state(data_dict, state, state_column=STATE_COLUMN):
+    """
+    The pickle's counterpart of read_state: `state`'s rows of each table, and
+    tables without `state_column` whole.
+    """
+    return {name: df[df[state_column] == state] if state_column in df.columns else df
+            for name, df in data_dict.items()}
+
+
+def read_arrow(s3, bucket, key):
+    """
+    Read one partition from the memory-mapped disk cache file.
+    """
+    buffer, _ = cached_download(s3, bucket, key)
+    with perf.span('parse.read_arrow', key=key):
+        return pa.ipc.open_file(pa.py_buffer(buffer)).read_all().to_pandas()
+
+
+def partition_key(manifest, table, state):
+    entry = manifest['tables'][table]
+    if not entry['partitioned']:
+        return entry['key']
+    return entry['partitions'][state]['key']
+
+
+def total_row(manifest, table, state, df):
+    """
+    Return the "Total" row for `state`'s rows `df` of `table`: precomputed sums
+    of the numeric columns and '-' elsewhere. Without a manifest (reading the
+    pickle) or with a store exported before totals were precomputed, `df` is
+    summed instead.
+    """
+    totals = None
+    if manifest is not None:
+        totals = manifest['tables'][table]['partitions'].get(state, {}).get('totals')
+    if totals is None:
+        numeric_columns = df.select_dtypes(include=['float', 'int']).columns
+        totals = df[numeric_columns].sum().to_dict()
+    row = dict.fromkeys(df.columns, '-')
+    row.update(totals)
+    return pd.DataFrame(row, index=['Total'])
+
+
+def read_state(s3, bucket, manifest, state, max_workers=8):
+    """
+    Return {table name: DataFrame} holding only `state`'s rows of each table,
+    fetching the partitions concurrently.
+    """
+    names = list(manifest['tables'])
+    keys = [partition_key(manifest, name, state) for name in names]
+    with perf.span('store.read_state', state=state, tables=len(names)), \
+            ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = list(pool.map(perf.bind(lambda key: read_arrow(s3, bucket, key)), keys))
+    return dict(zip(names, frames))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the dashboard pickle into the state-partitioned store.")
+    parser.add_argument('--bucket', required=True)
+    parser.add_argument('--source', default=SOURCE_KEY,
+                        help="S3 key of the pickle, or a local path with --local")
+    parser.add_argument('--local', action='store_true',
+                        help="read --source from the local filesystem; the store then records no source ETag "
+                             "and the dashboard keeps reading the pickle until it is converted from S3")
+    parser.add_argument('--prefix', default=STORE_PREFIX)
+    parser.add_argument('--state-column', default=STATE_COLUMN)
+    args = parser.parse_args()
+
+    # Uses the default AWS credential chain (environment, profile, role)
+    s3 = boto3.client('s3')
+    # The pickle is our own export; this one-off conversion is the only place it is still loaded
+    source_etag = None
+    if args.local:
+        with open(args.source, 'rb') as file:
+            data_dict = pickle.load(file)
+    else:
+        response = s3.get_object(Bucket=args.bucket, Key=args.source)
+        data_dict = pickle.loads(response['Body'].read())
+        source_etag = response['ETag']
+
+    manifest = export_partitioned(data_dict, s3, args.bucket, args.prefix, args.state_column, source_etag)
+    print(f"Wrote {len(manifest['tables'])} tables x {len(manifest['states'])} states to s3://{args.bucket}/{args.prefix}")
+
+
+if __name__ == "__main__":
+    main()
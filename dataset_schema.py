@@ -0,0 +1,210 @@
+"""
+Schema sidecars: a small JSON object per dataset version holding what the
+editor needs to know about a dataset without reading it, namely property
+names and profiled types, feature count, bounding box and the first rows.
+
+A sidecar lives at dataset_schema/<layer>.json, outside datasets/ so the
+dataset listings never pick it up, and records the ETag of the dataset it
+describes; a sidecar whose ETag no longer matches is stale. It has the
+"feature_count" and "columns" of a column profile, so it can be used
+wherever a profile is. Sidecars missing or stale are built in one pass over
+the dataset, and the batch mode backfills them for a whole bucket:
+
+    python dataset_schema.py --bucket dev-data-layer-datasets
+    python dataset_schema.py --bucket dev-data-layer-datasets --force --only datasets/lumber.json
+"""
+import argparse
+import json
+import math
+import sys
+import time
+from datetime import datetime, timezone
+
+import boto3
+import ijson
+from botocore.exceptions import ClientError
+from ijson.common import ObjectBuilder
+
+import perf
+from batch_runner import add_batch_arguments, finish, run_pool, worker_s3
+from column_profiler import profile_properties
+from metadata_audit import dataset_keys
+from s3_utils import list_keys, open_object
+
+SCHEMA_PREFIX = 'dataset_schema/'
+SCHEMA_VERSION = 1
+# Rows kept for the editor's previews, which show five
+PREVIEW_ROWS = 5
+
+
+def schema_key_for(dataset_key):
+    # datasets/<layer>.json -> dataset_schema/<layer>.json
+    return SCHEMA_PREFIX + dataset_key.split('/')[-1].split('.')[0] + '.json'
+
+
+def _features(events, bounds, preview, preview_rows):
+    """
+    Yield the properties of every feature from ijson events ({} when a
+    feature has none), widening `bounds` ([west, south, east, north]) with
+    its coordinates and keeping the first `preview_rows` in `preview`.
+    """
+    builder = None
+    properties = None
+    axis = 0
+    for prefix, event, value in events:
+        if builder is not None:
+            if prefix == 'features.item.properties' and event == 'end_map':
+                properties = builder.value
+                builder = None
+            else:
+                builder.event(event, value)
+        elif prefix == 'features.item.properties':
+            if event == 'start_map':
+                builder = ObjectBuilder()
+                builder.event(event, value)
+        elif prefix.startswith('features.item.geometry') and '.coordinates' in prefix:
+            # Positions are the innermost arrays: [x, y] or [x, y, z]
+            if event == 'start_array':
+                axis = 0
+            elif event == 'number':
+                if axis == 0:
+                    bounds[0] = min(bounds[0], value)
+                    bounds[2] = max(bounds[2], value)
+                elif axis == 1:
+                    bounds[1] = min(bounds[1], value)
+                    bounds[3] = max(bounds[3], value)
+                axis += 1
+        elif prefix == 'features.item' and event == 'end_map':
+            properties = properties or {}
+            if len(preview) < preview_rows:
+                preview.append(properties)
+            yield properties
+            properties = None
+
+
+def build_schema(s3, bucket, key, top_k=5, download=True, preview_rows=PREVIEW_ROWS):
+    """
+    Profile every feature of a GeoJSON object and return its schema sidecar.
+    Only the properties are built into Python objects; coordinates are read
+    as numbers for the bounding box. `download` is as for open_object.
+    """
+    body, etag = open_object(s3, bucket, key, download=download)
+    bounds = [math.inf, math.inf, -math.inf, -math.inf]
+    preview = []
+    with perf.span('parse.build_schema', key=key) as span:
+        try:
+            events = ijson.parse(body, use_float=True)
+            profile = profile_properties(_features(events, bounds, preview, preview_rows), top_k)
+        finally:
+            body.close()
+        span.set(features=profile["feature_count"])
+    return {
+        "version": SCHEMA_VERSION,
+        "dataset": key,
+        "etag": etag,
+        "created": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "feature_count": profile["feature_count"],
+        "bbox": bounds if bounds[0] <= bounds[2] else None,
+        "columns": profile["columns"],
+        "preview": preview,
+    }
+
+
+def read_schema(s3, bucket, dataset_key, etag=None):
+    """
+    The stored sidecar of a dataset, or None when it is missing, unreadable,
+    from an older schema version or, given the dataset's `etag`, stale.
+    """
+    try:
+        response = s3.get_object(Bucket=bucket, Key=schema_key_for(dataset_key))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    try:
+        schema = json.loads(response['Body'].read().decode('utf-8'))
+    except ValueError:
+        return None
+    if not isinstance(schema, dict) or schema.get('version') != SCHEMA_VERSION:
+        return None
+    if etag is not None and schema.get('etag') != etag:
+        return None
+    return schema
+
+
+def write_schema(s3, bucket, schema):
+    response = s3.put_object(
+        Body=json.dumps(schema, ensure_ascii=False, default=str),
+        Bucket=bucket,
+        Key=schema_key_for(schema['dataset']),
+        ContentType='application/json',
+    )
+    return response['ETag']
+
+
+def ensure_schema(s3, bucket, dataset_key, etag=None, download=True):
+    """
+    Return (schema, built): the current sidecar of a dataset, built and
+    stored first when it is missing or stale.
+    """
+    if etag is None:
+        etag = s3.head_object(Bucket=bucket, Key=dataset_key)['ETag']
+    schema = read_schema(s3, bucket, dataset_key, etag)
+    if schema is not None:
+        return schema, False
+    schema = build_schema(s3, bucket, dataset_key, download=download)
+    write_schema(s3, bucket, schema)
+    return schema, True
+
+
+# Backfill
+
+def backfill_dataset(bucket, dataset_key, force=False, s3=None):
+    """
+    Make sure one dataset has a current sidecar. Returns a report entry.
+    """
+    s3 = s3 or worker_s3()
+    started = time.perf_counter()
+    entry = {"dataset": dataset_key, "schema": schema_key_for(dataset_key)}
+    try:
+        if force:
+            schema = build_schema(s3, bucket, dataset_key, download=False)
+            write_schema(s3, bucket, schema)
+            built = True
+        else:
+            # Streamed rather than cached: a backfill reads each dataset once
+            schema, built = ensure_schema(s3, bucket, dataset_key, download=False)
+        entry["status"] = "built" if built else "current"
+        entry["features"] = schema["feature_count"]
+        entry["columns"] = len(schema["columns"])
+    except Exception as e:
+        entry["status"] = "error"
+        entry["error"] = f"{type(e).__name__}: {e}"
+    entry["seconds"] = round(time.perf_counter() - started, 3)
+    return entry
+
+
+def backfill(bucket, dataset_keys, force=False, workers=None):
+    """
+    Backfill the sidecars of `dataset_keys` in a process pool, printing
+    progress; returns the report entries in key order.
+    """
+    return run_pool(backfill_dataset, [(bucket, key, force) for key in dataset_keys], workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the missing or stale schema sidecars of every dataset.")
+    add_batch_arguments(parser, "backfill")
+    parser.add_argument('--force', action='store_true', help="rebuild sidecars that are still current")
+    parser.add_argument('--report', help="path of a JSON report")
+    args = parser.parse_args()
+
+    s3 = boto3.client('s3')
+    keys = args.only or sorted(dataset_keys(list_keys(s3, args.bucket, 'datasets/')))
+    started = time.perf_counter()
+    entries = backfill(args.bucket, keys, args.force, args.workers)
+    return finish(args.bucket, entries, started, "Checked", args.report)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
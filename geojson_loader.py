@@ -0,0 +1,101 @@
+"""
+Streaming GeoJSON reader for large uploads in Symbology.py.
+
+Features are parsed one at a time and only their geometry and the wanted
+properties are kept. Point coordinates go straight into flat arrays, so the
+memory held is close to that of the final frame rather than the raw JSON
+tree plus the frame.
+"""
+from array import array
+
+import geopandas as gpd
+import ijson
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+import perf
+
+
+def parse_bbox(text):
+    """
+    (west, south, east, north) from "west, south, east, north", or None
+    when `text` is blank.
+    """
+    if not text.strip():
+        return None
+    parts = [float(part) for part in text.replace(',', ' ').split()]
+    if len(parts) != 4:
+        raise ValueError("A bounding box needs four numbers: west, south, east, north")
+    west, south, east, north = parts
+    if west > east or south > north:
+        raise ValueError("A bounding box needs west <= east and south <= north")
+    return west, south, east, north
+
+
+@perf.timed('parse.read_geojson')
+def read_geojson(file, properties=None, bbox=None, limit=None, geometry=True):
+    """
+    Read the features of a GeoJSON FeatureCollection from a file object.
+
+    Only the `properties` columns are kept (every property when None, none
+    for an empty list). Features outside `bbox` (west, south, east, north)
+    are skipped, and reading stops after `limit` features. Without
+    `geometry` a plain DataFrame of the properties is returned, for adding
+    columns to a frame read earlier with the same `bbox` and `limit`.
+
+    The names of all properties seen in the kept features are listed in the
+    result's attrs['properties'].
+    """
+    if bbox is not None:
+        west, south, east, north = bbox
+    point_rows, xs, ys = array('q'), array('d'), array('d')
+    shape_rows, shapes = [], []
+    columns = {} if properties is None else {name: [] for name in properties}
+    names = {}
+    count = 0
+
+    # Each feature is built by the parser and dropped as soon as its
+    # geometry and wanted properties have been copied out
+    for feature in ijson.items(file, 'features.item', use_float=True):
+        geom = feature.get('geometry')
+        coordinates = geom.get('coordinates') if geom else None
+        if geom and geom.get('type') == 'Point' and coordinates and len(coordinates) >= 2:
+            x, y = coordinates[0], coordinates[1]
+            if bbox is not None and not (west <= x <= east and south <= y <= north):
+                continue
+            point_rows.append(count)
+            xs.append(x)
+            ys.append(y)
+        else:
+            parsed = shape(geom) if geom else None
+            if bbox is not None:
+                if parsed is None or parsed.is_empty:
+                    continue
+                min_x, min_y, max_x, max_y = parsed.bounds
+                if min_x > east or max_x < west or min_y > north or max_y < south:
+                    continue
+            shape_rows.append(count)
+            shapes.append(parsed)
+
+        values = feature.get('properties') or {}
+        names.update(dict.fromkeys(values))
+        if properties is None:
+            for name in values:
+                if name not in columns:
+                    columns[name] = [None] * count
+        for name, column in columns.items():
+            column.append(values.get(name))
+        count += 1
+        if limit and count >= limit:
+            break
+
+    frame = pd.DataFrame(columns, index=pd.RangeIndex(count))
+    if geometry:
+        geometries = np.empty(count, dtype=object)
+        geometries[np.frombuffer(point_rows, dtype=np.int64)] = shapely.points(np.frombuffer(xs), np.frombuffer(ys))
+        geometries[shape_rows] = shapes
+        frame = gpd.GeoDataFrame(frame, geometry=geometries, crs='EPSG:4326')
+    frame.attrs['properties'] = list(names)
+    return frame
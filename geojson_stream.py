@@ -0,0 +1,389 @@
+import math
+import os
+import random
+import sys
+import time
+
+import ijson
+import pandas as pd
+
+import perf
+from s3_utils import open_object
+
+SAMPLING_MODES = ["head", "reservoir", "stride", "stratified"]
+# Byte budget for the non-head sampling modes when none is given
+DEFAULT_MEMORY_BUDGET = 32 * 1024 * 1024
+# Most strata the stratified mode keeps apart; further values share one reservoir
+MAX_STRATA = 64
+# Stratum of the features whose value did not get a reservoir of its own
+OTHER_STRATUM = object()
+# ijson backends, fastest first. IJSON_BACKEND picks one for read_columns;
+# by default ijson uses the fastest one installed (yajl2_c ships in its wheels).
+IJSON_BACKENDS = ["yajl2_c", "yajl2_cffi", "yajl2", "python"]
+IJSON_BACKEND = os.environ.get('IJSON_BACKEND') or ijson.backend
+
+
+def approx_size(obj):
+    """
+    Rough in-memory size of a parsed JSON value, in bytes.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += sys.getsizeof(key) + approx_size(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            size += approx_size(value)
+    return size
+
+
+class HeadSampler:
+    """
+    The first features of the stream, until the count or byte budget is reached.
+    """
+
+    def __init__(self, limit, memory_budget, rng):
+        self.limit = limit
+        self.memory_budget = memory_budget
+        self.items = []
+        self.bytes = 0
+        self.seen = 0
+
+    def offer(self, feature):
+        # Returns False once no further feature can be kept
+        self.seen += 1
+        size = approx_size(feature) if self.memory_budget != math.inf else 0
+        if self.bytes + size > self.memory_budget and self.items:
+            return False
+        self.items.append((self.seen, feature, size))
+        self.bytes += size
+        return len(self.items) < self.limit
+
+    def features(self):
+        return [feature for _, feature, _ in self.items]
+
+
+class ReservoirSampler:
+    """
+    Uniform sample of the whole stream (Algorithm R). The reservoir holds as
+    many features as fit in the byte budget, up to `limit`, but never fewer
+    than `keep`.
+    """
+
+    def __init__(self, limit, memory_budget, rng, keep=1):
+        self.capacity = limit
+        self.memory_budget = memory_budget
+        self.rng = rng
+        self.keep = keep
+        self.items = []
+        self.bytes = 0
+        self.seen = 0
+        self.full = False
+
+    def offer(self, feature):
+        self.seen += 1
+        if not self.full:
+            size = approx_size(feature)
+            self.items.append((self.seen, feature, size))
+            self.bytes += size
+            if len(self.items) >= self.capacity or self.bytes > self.memory_budget:
+                # The reservoir size is fixed at whatever fits the budget
+                self.shrink(len(self.items), self.memory_budget)
+                self.full = True
+            return True
+
+        j = self.rng.randrange(self.seen)
+        if j < len(self.items):
+            size = approx_size(feature)
+            self.bytes += size - self.items[j][2]
+            self.items[j] = (self.seen, feature, size)
+            self.shrink(self.capacity, self.memory_budget)
+        return True
+
+    def _drop_random(self):
+        # A random subset of a uniform sample is still a uniform sample
+        j = self.rng.randrange(len(self.items))
+        self.items[j], self.items[-1] = self.items[-1], self.items[j]
+        self.bytes -= self.items.pop()[2]
+
+    def shrink(self, capacity, memory_budget):
+        self.capacity = capacity
+        self.memory_budget = memory_budget
+        dropped = False
+        while len(self.items) > self.keep and (len(self.items) > capacity or self.bytes > memory_budget):
+            self._drop_random()
+            dropped = True
+        if dropped:
+            self.capacity = len(self.items)
+        if len(self.items) >= self.capacity:
+            self.full = True
+
+    def features(self):
+        return [feature for _, feature, _ in sorted(self.items, key=lambda item: item[0])]
+
+
+class StrideSampler:
+    """
+    Every `stride`-th feature, evenly spread over the whole stream. The total
+    length is unknown up front, so the stride doubles (and every other kept
+    feature is dropped) whenever the sample outgrows its budget.
+    """
+
+    def __init__(self, limit, memory_budget, rng):
+        self.limit = limit
+        self.memory_budget = memory_budget
+        self.stride = 1
+        self.items = []
+        self.bytes = 0
+        self.seen = 0
+
+    def offer(self, feature):
+        index = self.seen
+        self.seen += 1
+        if index % self.stride:
+            return True
+        size = approx_size(feature)
+        self.items.append((index, feature, size))
+        self.bytes += size
+        while len(self.items) > 1 and (len(self.items) > self.limit or self.bytes > self.memory_budget):
+            self.stride *= 2
+            self.items = [item for item in self.items if item[0] % self.stride == 0]
+            self.bytes = sum(item[2] for item in self.items)
+        return True
+
+    def features(self):
+        return [feature for _, feature, _ in self.items]
+
+
+class StratifiedSampler:
+    """
+    One reservoir per value of the `stratify_by` property, so small strata
+    are represented as well as large ones. The count and byte budgets are
+    split evenly between slots, a power of two at least the number of
+    strata, and the reservoirs only shrink when the slots double. Values met
+    once MAX_STRATA strata (or as many as `limit` allows) exist, or whose
+    share of the budget could not hold a feature, share one reservoir. The
+    other reservoirs may empty out, so the byte budget holds for the whole
+    sample unless it cannot fit a single feature.
+    """
+
+    def __init__(self, limit, memory_budget, rng, stratify_by):
+        self.limit = limit
+        self.memory_budget = memory_budget
+        self.rng = rng
+        self.stratify_by = stratify_by
+        self.max_strata = MAX_STRATA if limit == math.inf else max(1, min(MAX_STRATA, int(limit)))
+        self.slots = 1
+        self.reservoirs = {}
+        self.seen = 0
+
+    def _share(self):
+        capacity = max(1, self.limit // self.slots) if self.limit != math.inf else math.inf
+        return capacity, self.memory_budget / self.slots
+
+    def _reservoir(self, stratum, feature):
+        reservoir = self.reservoirs.get(stratum)
+        if reservoir is not None:
+            return reservoir
+        count = len(self.reservoirs) + 1
+        slots = self.slots
+        while slots < count:
+            slots *= 2
+        if stratum is not OTHER_STRATUM and (
+                count > self.max_strata - (OTHER_STRATUM not in self.reservoirs)
+                or approx_size(feature) > self.memory_budget / slots):
+            return self._reservoir(OTHER_STRATUM, feature)
+        if slots != self.slots:
+            self.slots = slots
+            capacity, memory_budget = self._share()
+            for other in self.reservoirs.values():
+                other.shrink(capacity, memory_budget)
+        capacity, memory_budget = self._share()
+        keep = 1 if stratum is OTHER_STRATUM else 0
+        reservoir = self.reservoirs[stratum] = ReservoirSampler(capacity, memory_budget, self.rng, keep)
+        return reservoir
+
+    def offer(self, feature):
+        self.seen += 1
+        stratum = (feature.get('properties') or {}).get(self.stratify_by)
+        if isinstance(stratum, (dict, list)):
+            stratum = str(stratum)
+        self._reservoir(stratum, feature).offer(feature)
+        return True
+
+    @property
+    def strata(self):
+        return len(self.reservoirs) - (OTHER_STRATUM in self.reservoirs)
+
+    @property
+    def bytes(self):
+        return sum(reservoir.bytes for reservoir in self.reservoirs.values())
+
+    def features(self):
+        items = [item for reservoir in self.reservoirs.values() for item in reservoir.items]
+        return [feature for _, feature, _ in sorted(items, key=lambda item: item[0])]
+
+
+def stream_json_file(s3, bucket, key, limit=1000, sampling="head", memory_budget=None,
+                     stratify_by=None, seed=None):
+    """
+    Stream the features of a GeoJSON object and return a sample of them as a
+    partial FeatureCollection.
+
+    sampling:
+      "head"        the first `limit` features (the stream is closed early)
+      "reservoir"   a uniform random sample of the whole file
+      "stride"      every n-th feature, n chosen so the sample spans the file
+      "stratified"  a reservoir per value of the `stratify_by` property
+
+    `memory_budget` caps the approximate size of the kept features in bytes
+    (default: unbounded for "head", DEFAULT_MEMORY_BUDGET otherwise); `limit`
+    caps their number and may be None. Details of the sample are returned
+    under the "sample" key.
+    """
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"Unknown sampling mode {sampling!r}, expected one of {SAMPLING_MODES}")
+    if sampling == "stratified" and not stratify_by:
+        raise ValueError("Stratified sampling needs a `stratify_by` property")
+    if memory_budget is None:
+        memory_budget = math.inf if sampling == "head" else DEFAULT_MEMORY_BUDGET
+    if limit is None:
+        limit = math.inf
+
+    rng = random.Random(seed)
+    if sampling == "head":
+        sampler = HeadSampler(limit, memory_budget, rng)
+    elif sampling == "reservoir":
+        sampler = ReservoirSampler(limit, memory_budget, rng)
+    elif sampling == "stride":
+        sampler = StrideSampler(limit, memory_budget, rng)
+    else:
+        sampler = StratifiedSampler(limit, memory_budget, rng, stratify_by)
+
+    # The head of the file is served from the disk cache only when it already
+    # holds the object; the other modes read everything, so cache it first
+    body, _ = open_object(s3, bucket, key, download=(sampling != "head"))
+    with perf.span('parse.stream_json_file', key=key, mode=sampling) as span:
+        try:
+            for feature in ijson.items(body, 'features.item'):
+                if not sampler.offer(feature):
+                    break
+        finally:
+            body.close()
+        span.set(seen=sampler.seen)
+
+    # Reconstruct a partial JSON object
+    features = sampler.features()
+    partial_json = {
+        'type': 'FeatureCollection',
+        'features': features,
+        'sample': {
+            'mode': sampling,
+            'seen': sampler.seen,
+            'kept': len(features),
+            'bytes': sampler.bytes,
+        },
+    }
+    return partial_json
+
+
+@perf.timed('parse.convert_to_dataframe')
+def convert_to_dataframe(geojson_features):
+    # Extract the properties from each feature
+    properties_list = [feature['properties'] for feature in geojson_features['features']]
+    df = pd.DataFrame(properties_list)
+    return df
+
+
+def available_backends():
+    """
+    The ijson backends that can be loaded here, fastest first.
+    """
+    names = []
+    for name in IJSON_BACKENDS:
+        try:
+            ijson.get_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+class CountingReader:
+    """
+    File object counting the bytes a parser has read from the one it wraps.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.bytes = 0
+
+    def read(self, size=-1):
+        data = self.body.read(size)
+        self.bytes += len(data)
+        return data
+
+
+def properties_to_columns(properties_iter, limit=None):
+    """
+    Append the values of an iterable of feature `properties` dicts to one list
+    per column, None where a feature lacks the column. Returns
+    ({name: values}, rows), columns in order of first appearance.
+    """
+    columns = {}
+    rows = 0
+    for properties in properties_iter:
+        for name, value in (properties or {}).items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [None] * rows
+            column.append(value)
+        rows += 1
+        for column in columns.values():
+            if len(column) < rows:
+                column.append(None)
+        if limit is not None and rows >= limit:
+            break
+    return columns, rows
+
+
+def read_columns(s3, bucket, key, limit=1000, backend=None):
+    """
+    Parse the properties of the first `limit` features (all with None) of a
+    GeoJSON object straight into a DataFrame, for previews.
+
+    The parser filters events by prefix, so geometries are tokenized and
+    dropped without ever being built into Python objects (with yajl2_c, in C)
+    and numbers come out as floats rather than Decimals. `backend` names the
+    ijson backend, IJSON_BACKEND by default. Returns (df, stats), stats
+    holding the backend, features, bytes parsed, seconds and parse rates.
+    """
+    backend = backend or IJSON_BACKEND
+    parser = ijson.get_backend(backend)
+    body, _ = open_object(s3, bucket, key, download=False)
+    reader = CountingReader(body)
+    with perf.span('parse.read_columns', key=key, backend=backend) as span:
+        start_time = time.perf_counter()
+        try:
+            properties = parser.items(reader, 'features.item.properties', use_float=True)
+            columns, rows = properties_to_columns(properties, limit)
+        finally:
+            body.close()
+        df = pd.DataFrame(columns)
+        elapsed = time.perf_counter() - start_time
+        span.set(features=rows, bytes=reader.bytes)
+    stats = {
+        'backend': backend,
+        'features': rows,
+        'bytes': reader.bytes,
+        'seconds': elapsed,
+        'mb_per_second': reader.bytes / 1024 / 1024 / elapsed if elapsed else 0.0,
+        'features_per_second': rows / elapsed if elapsed else 0.0,
+    }
+    return df, stats
+
+
+def format_parse(stats):
+    return (f"Parsed {stats['features']:,} features ({stats['bytes'] / 1024 / 1024:.1f} MB) in "
+            f"{stats['seconds']:.2f} s with {stats['backend']}: {stats['mb_per_second']:.1f} MB/s, "
+            f"{stats['features_per_second']:,.0f} features/s")
@@ -0,0 +1,217 @@
+"""
+Folium layers that take whole columns instead of one Python object per
+feature, for rendering large uploads in Symbology.py.
+"""
+import json
+from html import escape
+
+import numpy as np
+from branca.element import MacroElement
+from jinja2 import Template
+
+COORDINATE_DECIMALS = 6
+
+
+def hex_palette(rgba):
+    """
+    '#rrggbb' strings for an (n, 4) array of RGBA floats in [0, 1].
+    """
+    rgb = np.clip(np.round(np.asarray(rgba)[:, :3] * 255), 0, 255).astype(int)
+    return ['#%02x%02x%02x' % tuple(color) for color in rgb]
+
+
+def point_coordinates(geo_df):
+    """
+    (lat, lon) arrays for the features of `geo_df`. Points use their own
+    coordinates, other geometries a representative point inside them.
+    """
+    geometry = geo_df.geometry
+    if not (geometry.geom_type == 'Point').all():
+        geometry = geometry.representative_point()
+    return geometry.y.to_numpy(), geometry.x.to_numpy()
+
+
+def _column(values, decimals=None):
+    # A scalar is sent once instead of repeating it per feature
+    if np.ndim(values) == 0:
+        return values.item() if hasattr(values, 'item') else values
+    values = np.asarray(values)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    return values.tolist()
+
+
+class CirclePointLayer(MacroElement):
+    """
+    All points of a layer as circle markers drawn on one shared canvas.
+
+    Coordinates and styles are sent as parallel arrays: `color` holds indices
+    into `palette`, and `radius` and `opacity` are either an array or one
+    value for every point. Leaflet draws the markers itself, so the page
+    carries a few numbers per feature rather than a marker definition each.
+    """
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function() {
+            var data = {{ this.data }};
+            var renderer = L.canvas({padding: 0.5});
+            var group = L.featureGroup();
+            var pick = function(values, i) { return Array.isArray(values) ? values[i] : values; };
+            for (var i = 0; i < data.lat.length; i++) {
+                var color = data.palette[pick(data.color, i)];
+                L.circleMarker([data.lat[i], data.lon[i]], {
+                    renderer: renderer,
+                    radius: pick(data.radius, i),
+                    color: color,
+                    weight: 1,
+                    fill: true,
+                    fillColor: color,
+                    fillOpacity: pick(data.opacity, i)
+                }).addTo(group);
+            }
+            return group;
+        })();
+        {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    def __init__(self, lat, lon, palette, color=0, radius=5, opacity=0.7):
+        super().__init__()
+        self._name = 'CirclePointLayer'
+        self.data = json.dumps({
+            'lat': _column(lat, COORDINATE_DECIMALS),
+            'lon': _column(lon, COORDINATE_DECIMALS),
+            'palette': list(palette),
+            'color': _column(color),
+            'radius': _column(radius, 2),
+            'opacity': _column(opacity, 3),
+        }, separators=(',', ':'))
+
+
+class Legend(MacroElement):
+    """
+    Legend box listing (color, label) pairs, as a Leaflet control so it is
+    kept by st_folium (which only carries the map's scripts). Long category
+    lists are cut off after `max_items` entries.
+    """
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.control({position: 'bottomright'});
+        {{ this.get_name() }}.onAdd = function() {
+            var div = L.DomUtil.create('div');
+            div.style.cssText = 'max-height: 300px; overflow-y: auto; background: white; padding: 6px 10px; '
+                + 'border-radius: 4px; box-shadow: 0 0 6px rgba(0,0,0,0.3); font: 12px sans-serif;';
+            div.innerHTML = {{ this.html }};
+            return div;
+        };
+        {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    def __init__(self, title, items, max_items=25):
+        super().__init__()
+        self._name = 'Legend'
+        rows = [f'<b>{escape(str(title))}</b>']
+        rows += [
+            f'<div><span style="display: inline-block; width: 12px; height: 12px; margin-right: 6px; '
+            f'background: {color};"></span>{escape(str(label))}</div>'
+            for color, label in items[:max_items]
+        ]
+        if len(items) > max_items:
+            rows.append(f'<div>… {len(items) - max_items} more</div>')
+        self.html = json.dumps(''.join(rows))
+
+
+class ClusterLayer(MacroElement):
+    """
+    Precomputed clusters, drawn as count bubbles. Single points are drawn
+    as plain circle markers, and clicking a bubble zooms in on it.
+    """
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function() {
+            var data = {{ this.data }};
+            var map = {{ this._parent.get_name() }};
+            var renderer = L.canvas({padding: 0.5});
+            var group = L.featureGroup();
+            for (var i = 0; i < data.lat.length; i++) {
+                var latlng = L.latLng(data.lat[i], data.lon[i]);
+                var count = data.count[i];
+                if (count == 1) {
+                    L.circleMarker(latlng, {
+                        renderer: renderer, radius: 5, color: 'blue', weight: 1,
+                        fill: true, fillColor: 'blue', fillOpacity: 0.7
+                    }).addTo(group);
+                    continue;
+                }
+                var size = count < 10 ? 30 : count < 100 ? 36 : count < 1000 ? 42 : 48;
+                var color = count < 10 ? '110,204,57' : count < 100 ? '240,194,12' : '241,128,23';
+                var icon = L.divIcon({
+                    html: '<div style="width:' + size + 'px;height:' + size + 'px;line-height:' + size
+                        + 'px;border-radius:50%;text-align:center;font:12px sans-serif;background:rgba('
+                        + color + ',0.7)">' + count.toLocaleString() + '</div>',
+                    className: '',
+                    iconSize: L.point(size, size)
+                });
+                L.marker(latlng, {icon: icon}).on('click', function(e) {
+                    map.setView(e.latlng, map.getZoom() + 2);
+                }).addTo(group);
+            }
+            return group;
+        })();
+        {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    def __init__(self, lat, lon, count):
+        super().__init__()
+        self._name = 'ClusterLayer'
+        self.data = json.dumps({
+            'lat': _column(lat, COORDINATE_DECIMALS),
+            'lon': _column(lon, COORDINATE_DECIMALS),
+            'count': _column(count),
+        }, separators=(',', ':'))
+
+
+class ShapeLayer(MacroElement):
+    """
+    Lines and polygons drawn as one GeoJSON layer on a shared canvas.
+
+    `geometries` are GeoJSON geometry strings, inserted into the page as
+    they are; `color` indexes `palette` and `weight` is the outline width,
+    each an array or one value for every shape.
+    """
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function() {
+            var data = {{ this.data }};
+            var pick = function(values, i) { return Array.isArray(values) ? values[i] : values; };
+            var layer = L.geoJSON(null, {
+                renderer: L.canvas({padding: 0.5}),
+                style: function(feature) {
+                    var i = feature.properties.i;
+                    var color = data.palette[pick(data.color, i)];
+                    return {color: color, weight: pick(data.weight, i), fillColor: color,
+                            fillOpacity: pick(data.opacity, i)};
+                }
+            });
+            for (var i = 0; i < data.geometries.length; i++) {
+                layer.addData({type: 'Feature', geometry: data.geometries[i], properties: {i: i}});
+            }
+            return layer;
+        })();
+        {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    def __init__(self, geometries, palette, color=0, weight=1, opacity=0.5):
+        super().__init__()
+        self._name = 'ShapeLayer'
+        styles = json.dumps({
+            'palette': list(palette),
+            'color': _column(color),
+            'weight': _column(weight, 2),
+            'opacity': _column(opacity, 3),
+        }, separators=(',', ':'))
+        # The geometry strings are already JSON, so they are joined rather than re-encoded
+        self.data = '{"geometries":[' + ','.join(geometries) + '],' + styles[1:]
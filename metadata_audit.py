@@ -0,0 +1,298 @@
+"""
+Layer metadata checks shared by the editor (app.py) and a headless batch
+audit of every dataset in the bucket.
+
+The library functions take plain dicts: a layer's metadata and the
+property columns found in its dataset (with their profiled types). The
+batch mode streams every datasets/*.json in a process pool, compares it
+with its metadata/*_metadata.json and writes a mismatch report, plus fixed
+metadata on request:
+
+    python metadata_audit.py --bucket dev-data-layer-datasets --report audit.json
+    python metadata_audit.py --bucket dev-data-layer-datasets --report audit.json --fixed-dir fixed/
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import boto3
+import ijson
+
+from batch_runner import add_batch_arguments, finish, run_pool, worker_s3
+from column_profiler import profile_properties
+from metadata_catalog import fetch_metadata, layer_id_for_key, list_metadata_objects, update_metadata_index
+from s3_utils import list_keys, open_object
+
+# Every field of a layer's metadata, with its default
+METADATA_FORMAT = {
+    "name": "",
+    "layer_id": "",
+    "geom_type": "",
+    "geom_join": "",
+    "description": "",
+    "obj_details_column": "",
+    "has_biomass": False,
+    "has_county_geoid": False,
+    "value_columns": [],
+    "category_columns": [],
+    "details_columns": [],
+    "data_columns": [],
+    "tooltip-title": "",
+    "tooltip-content": "",
+    "s3_file_path": "",
+    "view_name": "",
+    "updated_at": "",
+    "details_modals": [],
+    "columns": [],
+    "calculated_fields": [],
+    "human_identifier_field": "",
+    "mandatory_filter": [],
+    "layer_access_level": 2,
+    "supplier_layer": False,
+    "visualization": {}
+}
+COLUMN_LISTS = ["value_columns", "category_columns", "details_columns", "data_columns"]
+GEOMETRY_COLUMNS = ["geometry", "geom"]
+COLUMN_TYPES = ["text", "float", "int", "boolean"]
+
+
+def empty_metadata():
+    return copy.deepcopy(METADATA_FORMAT)
+
+
+def metadata_key_for(dataset_key):
+    # datasets/<layer>.json -> metadata/<layer>_metadata.json, where the editor saves it
+    return 'metadata/' + dataset_key.split('/')[-1].split('.')[0] + "_metadata.json"
+
+
+def dataset_keys(keys):
+    """
+    The top-level JSON datasets among the keys listed under datasets/.
+    """
+    return [key for key in keys if key.endswith('json') and key.count('/') == 1]
+
+
+def dedupe(values):
+    # Duplicates removed, first occurrences kept in order
+    return list(dict.fromkeys(values))
+
+
+def with_geom(data_columns):
+    return dedupe(list(data_columns) + ['geom'])
+
+
+def dataset_columns(sample_columns, profile=None):
+    """
+    Property columns of a dataset: those of the preview sample, then any
+    more the full profile found.
+    """
+    columns = list(sample_columns)
+    if profile:
+        columns += list(profile["columns"])
+    return dedupe(columns)
+
+
+def candidate_columns(columns):
+    """
+    The columns that can be picked as value, category or details columns:
+    everything but the geometry.
+    """
+    return [column for column in columns if column not in GEOMETRY_COLUMNS]
+
+
+def normalize_metadata(metadata):
+    """
+    A copy of `metadata` holding only the METADATA_FORMAT fields, with
+    duplicates removed from the column lists.
+    """
+    normalized = {key: copy.deepcopy(value) for key, value in metadata.items() if key in METADATA_FORMAT}
+    for name in COLUMN_LISTS:
+        normalized[name] = dedupe(normalized.get(name, []))
+    return normalized
+
+
+def column_mismatches(metadata, columns):
+    """
+    (data_columns missing from the data, data columns missing from
+    data_columns), given the dataset's candidate `columns`.
+    """
+    listed = dedupe(metadata.get("data_columns", []))
+    actual = dedupe(list(columns) + ['geom'])
+    return [column for column in listed if column not in actual], [column for column in actual if column not in listed]
+
+
+def new_column_entry(name, profile=None):
+    """
+    A `columns` entry for a column the metadata does not describe yet, typed
+    from the profile when it has the column.
+    """
+    column_type = "text"
+    if profile and name in profile["columns"]:
+        column_type = profile["columns"][name]["type"]
+    return {"name": name, "label": name, "type": column_type, "description": ""}
+
+
+def audit_metadata(metadata, columns, profile=None):
+    """
+    Everything the editor would flag or change in `metadata` for a dataset
+    with candidate `columns`. Every value is empty when there is nothing to fix.
+    """
+    documented = {entry.get("name") for entry in metadata.get("columns", [])}
+    selected = dedupe(sum((list(metadata.get(name, [])) for name in COLUMN_LISTS), []))
+    missing_in_data, missing_in_metadata = column_mismatches(metadata, columns)
+    return {
+        "missing_in_data": missing_in_data,
+        "missing_in_metadata": missing_in_metadata,
+        # Picked as value, category or details columns but not in the data
+        "unknown_columns": [column for column in selected
+                            if column not in columns and column != 'geom' and column not in missing_in_data],
+        "undocumented": [column for column in selected
+                         if column in columns and column not in documented],
+        "duplicates": {name: sorted({value for value in metadata.get(name, [])
+                                     if metadata[name].count(value) > 1})
+                       for name in COLUMN_LISTS if len(set(metadata.get(name, []))) != len(metadata.get(name, []))},
+        "missing_geom": 'geom' not in metadata.get("data_columns", []),
+        "extra_fields": sorted(key for key in metadata if key not in METADATA_FORMAT),
+        "missing_fields": [key for key in METADATA_FORMAT if key not in metadata],
+    }
+
+
+def is_clean(audit):
+    return not any(audit.values())
+
+
+def fix_metadata(metadata, columns, profile=None):
+    """
+    `metadata` as the editor would save it without further edits: only the
+    known fields (missing ones at their defaults), column lists deduplicated
+    and limited to columns in the data, 'geom' in data_columns, and a
+    `columns` entry for every selected column. Existing entries are kept as
+    they are; the geometry gets none.
+    """
+    fixed = empty_metadata()
+    fixed.update(normalize_metadata(metadata))
+    for name in ["value_columns", "category_columns", "details_columns"]:
+        fixed[name] = [column for column in fixed[name] if column in columns]
+    fixed["data_columns"] = with_geom(
+        [column for column in fixed["value_columns"] + fixed["category_columns"] + fixed["details_columns"]
+         + fixed["data_columns"] if column in columns]
+    )
+
+    existing = {entry.get("name"): entry for entry in fixed["columns"]}
+    fixed["columns"] = [existing.get(column) or new_column_entry(column, profile)
+                        for column in fixed["data_columns"] if column != 'geom']
+    if fixed != metadata:
+        fixed["updated_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    return fixed
+
+
+# Batch audit
+
+def profile_dataset(s3, bucket, key):
+    """
+    Profile every feature's properties, streamed from S3 without caching the
+    object locally.
+    """
+    body, etag = open_object(s3, bucket, key, download=False)
+    try:
+        profile = profile_properties(ijson.items(body, 'features.item.properties'))
+    finally:
+        body.close()
+    profile["etag"] = etag
+    return profile
+
+
+def audit_layer(bucket, dataset_key, metadata_key, fix=False, s3=None):
+    """
+    Audit one dataset against its metadata object (None when it has none).
+    Returns a report entry, with the fixed metadata under "fixed" when `fix`
+    is set and there is something to fix.
+    """
+    s3 = s3 or worker_s3()
+    started = time.perf_counter()
+    entry = {"dataset": dataset_key, "metadata": metadata_key}
+    try:
+        profile = profile_dataset(s3, bucket, dataset_key)
+        columns = candidate_columns(profile["columns"])
+        entry["features"] = profile["feature_count"]
+        if metadata_key is None:
+            entry["status"] = "missing_metadata"
+            if fix:
+                metadata = empty_metadata()
+                metadata["s3_file_path"] = dataset_key
+                entry["fixed"] = fix_metadata(metadata, columns, profile)
+        else:
+            etag, metadata = fetch_metadata(s3, bucket, metadata_key)
+            entry["metadata_etag"] = etag
+            audit = audit_metadata(metadata, columns, profile)
+            entry["status"] = "ok" if is_clean(audit) else "mismatch"
+            entry.update({name: value for name, value in audit.items() if value})
+            if fix and not is_clean(audit):
+                entry["fixed"] = fix_metadata(metadata, columns, profile)
+    except Exception as e:
+        entry["status"] = "error"
+        entry["error"] = f"{type(e).__name__}: {e}"
+    entry["seconds"] = round(time.perf_counter() - started, 3)
+    return entry
+
+
+def plan_audit(s3, bucket):
+    """
+    [(dataset key, metadata key or None)] for every dataset, pairing them
+    by layer name the way the editor saves metadata.
+    """
+    metadata_keys = {layer_id_for_key(key): key for key in list_metadata_objects(s3, bucket)}
+    datasets = dataset_keys(list_keys(s3, bucket, 'datasets/'))
+    return [(key, metadata_keys.get(layer_id_for_key(key))) for key in sorted(datasets)]
+
+
+def run_audit(bucket, tasks, fix=False, workers=None):
+    """
+    Audit `tasks` in a process pool, printing progress; returns the report
+    entries in task order.
+    """
+    return run_pool(audit_layer, [(bucket, dataset, metadata, fix) for dataset, metadata in tasks], workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check every dataset's metadata against the data in a process pool.")
+    add_batch_arguments(parser, "audit")
+    parser.add_argument('--report', default='metadata_audit.json', help="path of the JSON report")
+    parser.add_argument('--fixed-dir', help="write fixed metadata for the flagged layers to this directory")
+    parser.add_argument('--upload-fixed', action='store_true',
+                        help="also save the fixed metadata to the bucket and the metadata index")
+    args = parser.parse_args()
+
+    s3 = boto3.client('s3')
+    tasks = plan_audit(s3, args.bucket)
+    if args.only:
+        tasks = [task for task in tasks if task[0] in args.only]
+    fix = bool(args.fixed_dir or args.upload_fixed)
+    started = time.perf_counter()
+    entries = run_audit(args.bucket, tasks, fix, args.workers)
+
+    for entry in entries:
+        fixed = entry.pop("fixed", None)
+        if fixed is None:
+            continue
+        key = entry["metadata"] or metadata_key_for(entry["dataset"])
+        body = json.dumps(fixed, indent=2, ensure_ascii=False)
+        if args.fixed_dir:
+            os.makedirs(args.fixed_dir, exist_ok=True)
+            with open(os.path.join(args.fixed_dir, key.split('/')[-1]), 'w') as f:
+                f.write(body)
+            entry["fixed_file"] = key.split('/')[-1]
+        if args.upload_fixed:
+            response = s3.put_object(Body=body, Bucket=args.bucket, Key=key)
+            update_metadata_index(s3, args.bucket, key, response['ETag'], fixed)
+            entry["uploaded"] = key
+
+    return finish(args.bucket, entries, started, "Audited", args.report, entries_field="layers")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+import perf
+
+# Upper bound on simultaneous GETs when (re)loading the catalog
+MAX_WORKERS = 16
+
+# Consolidated index of every metadata object. It lives outside metadata/ so the
+# prefix listings and the name matching in app.py never pick it up.
+INDEX_KEY = 'metadata_index/index.json'
+# Version 2 keys the layers by metadata object key (version 1 used the layer name)
+INDEX_VERSION = 2
+# Summary fields copied from each metadata file into its index entry
+INDEX_FIELDS = ["name", "layer_id", "geom_type", "s3_file_path", "layer_access_level", "updated_at"]
+# Attempts at a conditional index write before giving up on a lost race
+INDEX_RETRIES = 5
+# Seconds after which a stored index is reconciled with a listing again, so
+# metadata written without update_metadata_index (by hand, other tools) shows up
+INDEX_MAX_AGE = float(os.environ.get('METADATA_INDEX_MAX_AGE', 300))
+
+
+def list_metadata_objects(s3, bucket, prefix='metadata/'):
+    """
+    Return {key: etag} for every top-level metadata JSON object under `prefix`.
+    """
+    paginator = s3.get_paginator('list_objects_v2')
+    objects = {}
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if key.endswith('json') and key.count('/') == 1:
+                objects[key] = obj['ETag']
+    return objects
+
+
+def fetch_metadata(s3, bucket, key):
+    response = s3.get_object(Bucket=bucket, Key=key)
+    metadata = json.loads(response['Body'].read().decode('utf-8'))
+    return response['ETag'], metadata
+
+
+def fetch_all_metadata(s3, bucket, keys, max_workers=MAX_WORKERS):
+    """
+    Download `keys` concurrently and return {key: (etag, metadata)}.
+    """
+    if not keys:
+        return {}
+    with perf.span('metadata.fetch_all', objects=len(keys)), \
+            ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as pool:
+        results = pool.map(perf.bind(lambda key: fetch_metadata(s3, bucket, key)), keys)
+        return dict(zip(keys, results))
+
+
+class MetadataCatalog:
+    """
+    In-memory layer x key table of every metadata object in a bucket.
+
+    `refresh` lists the prefix once (or takes the listing from the metadata
+    index) and re-downloads, in parallel, only the objects whose ETag changed
+    since the last refresh. Lookups never touch S3.
+    """
+
+    def __init__(self):
+        self.entries = {}  # key -> {"etag": ..., "metadata": {...}}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def refresh(self, s3, bucket, prefix='metadata/', listing=None, max_workers=MAX_WORKERS):
+        if listing is None:
+            listing = list_metadata_objects(s3, bucket, prefix)
+
+        # Forget objects that were deleted since the last refresh
+        for key in set(self.entries) - set(listing):
+            del self.entries[key]
+
+        stale = [key for key, etag in listing.items()
+                 if self.entries.get(key, {}).get('etag') != etag]
+        for key, (etag, metadata) in fetch_all_metadata(s3, bucket, stale, max_workers).items():
+            self.entries[key] = {'etag': etag, 'metadata': metadata}
+        return len(stale)
+
+    def values_for(self, field, default="N/A"):
+        """
+        Return {metadata key: value of `field`} for every layer, sorted by key.
+        """
+        return {key: self.entries[key]['metadata'].get(field, default) for key in sorted(self.entries)}
+
+
+# Metadata index
+
+def layer_id_for_key(key):
+    # metadata/<layer>_metadata.json -> <layer>, the same stem app.py saves under
+    stem = key.split('/')[-1].rsplit('.', 1)[0]
+    return stem[:-len('_metadata')] if stem.endswith('_metadata') else stem
+
+
+def index_entry(key, etag, metadata):
+    entry = {'key': key, 'etag': etag}
+    entry.update({field: metadata[field] for field in INDEX_FIELDS if field in metadata})
+    return entry
+
+
+def read_metadata_index(s3, bucket):
+    """
+    Return (index, etag) for the stored index.
+
+    `index` is None when the object is missing, unreadable or written by an
+    older index version; `etag` is None only when the object does not exist.
+    """
+    try:
+        response = s3.get_object(Bucket=bucket, Key=INDEX_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None, None
+        raise
+    try:
+        index = json.loads(response['Body'].read().decode('utf-8'))
+    except ValueError:
+        return None, response['ETag']
+    if not isinstance(index, dict) or index.get('version') != INDEX_VERSION:
+        return None, response['ETag']
+    return index, response['ETag']
+
+
+def index_expired(index, max_age=None):
+    """
+    True when `index` was last written or reconciled over `max_age` seconds
+    (default INDEX_MAX_AGE) ago, or has no readable "updated_at".
+    """
+    if max_age is None:
+        max_age = INDEX_MAX_AGE
+    try:
+        updated = datetime.strptime(index['updated_at'], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except (KeyError, TypeError, ValueError):
+        return True
+    return (datetime.now(timezone.utc) - updated).total_seconds() > max_age
+
+
+def write_metadata_index(s3, bucket, index, etag):
+    """
+    Store `index` only if the stored object still has `etag` (or, with no
+    `etag`, still does not exist). Returns False when another writer won.
+    """
+    index['updated_at'] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    try:
+        s3.put_object(
+            Body=json.dumps(index, ensure_ascii=False, indent=1),
+            Bucket=bucket,
+            Key=INDEX_KEY,
+            ContentType='application/json',
+            **condition
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            return False
+        raise
+    return True
+
+
+def _backoff(attempt):
+    time.sleep(0.1 * 2 ** attempt * (1 + random.random()))
+
+
+@perf.timed('metadata.rebuild_index')
+def rebuild_metadata_index(s3, bucket, prefix='metadata/', max_workers=MAX_WORKERS):
+    """
+    Reconcile the index with a listing of `prefix` and store it if it changed.
+
+    Entries whose ETag still matches are kept as they are; only new or
+    modified metadata files are downloaded. An unchanged index is rewritten
+    only when it has expired, to record that it was checked.
+    """
+    for attempt in range(INDEX_RETRIES):
+        current, etag = read_metadata_index(s3, bucket)
+        listing = list_metadata_objects(s3, bucket, prefix)
+
+        known = (current or {}).get('layers', {})
+        layers = {}
+        stale = []
+        for key, object_etag in sorted(listing.items()):
+            if key in known and known[key]['etag'] == object_etag:
+                layers[key] = known[key]
+            else:
+                stale.append(key)
+        for key, (object_etag, metadata) in fetch_all_metadata(s3, bucket, stale, max_workers).items():
+            layers[key] = index_entry(key, object_etag, metadata)
+        layers = dict(sorted(layers.items()))
+
+        index = {'version': INDEX_VERSION, 'layers': layers}
+        if current is not None and current.get('layers') == layers and not index_expired(current):
+            return current
+        if write_metadata_index(s3, bucket, index, etag):
+            return index
+        _backoff(attempt)
+    # Kept losing the race to other writers; what we built is still a valid view
+    return index
+
+
+def update_metadata_index(s3, bucket, key, etag, metadata):
+    """
+    Record a freshly saved metadata object in the index.
+    """
+    for attempt in range(INDEX_RETRIES):
+        index, index_etag = read_metadata_index(s3, bucket)
+        if index is None:
+            # Missing or unusable index: a rebuild picks up the object just saved
+            return rebuild_metadata_index(s3, bucket, key.rsplit('/', 1)[0] + '/')
+        index['layers'][key] = index_entry(key, etag, metadata)
+        if write_metadata_index(s3, bucket, index, index_etag):
+            return index
+        _backoff(attempt)
+    raise Exception(f"Could not update {INDEX_KEY} after {INDEX_RETRIES} attempts")
+
+
+def load_metadata_index(s3, bucket):
+    """
+    Return the metadata index with a single GET, rebuilding it when it is
+    missing, was written by an older version or has expired (INDEX_MAX_AGE).
+    """
+    index, _ = read_metadata_index(s3, bucket)
+    if index is None or index_expired(index):
+        index = rebuild_metadata_index(s3, bucket)
+    return index
+
+
+def find_index_entry(index, name):
+    """
+    Return the first entry (by key) whose metadata key contains `name`,
+    matching how app.py used to scan the metadata/ listing.
+    """
+    name = name.lower()
+    for entry in sorted(index['layers'].values(), key=lambda entry: entry['key']):
+        if name in entry['key'].lower():
+            return entry
+    return None
+
+
+def index_listing(index):
+    return {entry['key']: entry['etag'] for entry in index['layers'].values()}
+
+
+def index_values(index, field, default="N/A"):
+    """
+    Return {metadata key: value of `field`} for an INDEX_FIELDS field, sorted by key.
+    """
+    entries = sorted(index['layers'].values(), key=lambda entry: entry['key'])
+    return {entry['key']: entry.get(field, default) for entry in entries}
@@ -1,6 +1,5 @@
 import streamlit as st
 import os
-import boto3
 import json
 import pandas as pd
 import ijson
@@ -8,6 +7,10 @@ from datetime import datetime, timezone
 from io import BytesIO
 import pickle
 
+from dashboard_store import STATE_COLUMN, read_source, read_state, source_state, store_status, total_row
+from perf import show_panel, start_page
+from s3_utils import get_s3_client
+
 aws_access_key_id = st.secrets["Access_key_ID"]
 aws_default_region = st.secrets["AWS_DEFAULT_REGION"]
 
@@ -20,13 +23,9 @@ if aws_secret_access_key == "":
     st.stop()
 
 
-s3 =  boto3.client(
-    's3',
-    aws_access_key_id=aws_access_key_id,
-    aws_secret_access_key=aws_secret_access_key,
-    region_name=aws_default_region
-)
+s3 = get_s3_client(aws_access_key_id, aws_secret_access_key, aws_default_region)
 bucket_name = 'dev-data-layer-datasets'
+perf_trace = start_page("Infrastructure")
 
 def stream_json_file(s3,bucket, key, limit=1000):
     response = s3.get_object(Bucket=bucket, Key=key)
@@ -45,45 +44,61 @@ def stream_json_file(s3,bucket, key, limit=1000):
     
     return partial_json
 
-object_key = 'dashboard/dict.pkl'
-# Create a buffer
-pickle_buffer = BytesIO()
-# Download the object 'your-pickle-file.pkl' from the bucket 'your-bucket-name'
-s3.download_fileobj(bucket_name, object_key, pickle_buffer)
-# Set the buffer's position to the start
-pickle_buffer.seek(0)
-# Load the data from the buffer
-data_dict = pickle.load(pickle_buffer)
-# with open('dict.pkl', 'rb') as file:
-#     data_dict = pickle.load(file)
-
-# Get the list of unique state names from one of the dataframes
-state_names = data_dict[list(data_dict.keys())[0]]['state_name'].unique()
+@st.cache_resource(max_entries=16)
+def load_state(_s3, bucket, _manifest, manifest_etag, state):
+    # Frames are shared, not copied, between reruns; the manifest ETag ties them to one export
+    return read_state(_s3, bucket, _manifest, state)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def check_store(_s3, bucket):
+    # One HEAD of dict.pkl a minute at most, rather than on every rerun
+    return store_status(_s3, bucket)
+
+@st.cache_resource(max_entries=1, ttl=300)
+def load_source(_s3, bucket):
+    # Fallback while the store is missing or stale; dict.pkl is re-read every five minutes at most
+    return read_source(_s3, bucket)
+
+# The tables of dashboard/dict.pkl, stored per state as Arrow files (see
+# dashboard_store.py). Only the selected state's partitions are read, memory
+# mapped from the local disk cache.
+manifest, problem = check_store(s3, bucket_name)
+if manifest is not None:
+    # State names in the order they appear in the first dataframe
+    state_names = manifest['states']
+else:
+    st.warning(f"{problem} Reading dict.pkl instead, which is slower; "
+               "convert it with `python dashboard_store.py`.")
+    try:
+        source = load_source(s3, bucket_name)
+    except Exception as e:
+        st.error(f"Could not load dict.pkl either ({e}).")
+        st.stop()
+    first = next(iter(source.values()))
+    state_names = [state for state in first[STATE_COLUMN].unique() if not pd.isna(state)]
 
 # Create a Streamlit selectbox for state selection
 selected_state = st.selectbox('Select a state', state_names)
 
+if manifest is not None:
+    data_dict = load_state(s3, bucket_name, manifest, manifest['etag'], selected_state)
+else:
+    data_dict = source_state(source, selected_state)
+
 # Iterate over the dataframes in the dictionary
 for key, df in data_dict.items():
-    # Apply the state filter to each dataframe
-    filtered_df = df[df['state_name'] == selected_state]
+    # Partitions already hold only the selected state; tables without a state
+    # column are stored (and shown) whole
+    filtered_df = df
     
     # Check if the filtered dataframe has more than 1 row
     if len(filtered_df) > 1:
-        # Calculate the sum of float columns
-        float_cols = filtered_df.select_dtypes(include=['float','int']).columns
-        total_row = filtered_df[float_cols].sum().tolist()
-        
-        # Create a dictionary for the total row
-        total_row_dict = dict(zip(filtered_df.columns, ['-'] * len(filtered_df.columns)))
-        total_row_dict.update(dict(zip(float_cols, total_row)))
-        
-        # Convert the total row dictionary to a DataFrame
-        total_row_df = pd.DataFrame(total_row_dict, index=['Total'])
-        
-        # Concatenate the filtered dataframe with the total row DataFrame
-        filtered_df = pd.concat([filtered_df, total_row_df])
+        # The total row comes from the sums precomputed when the store was exported
+        # (or, reading dict.pkl, from summing the rows)
+        filtered_df = pd.concat([filtered_df, total_row(manifest, key, selected_state, filtered_df)])
     
     # Display the filtered dataframe
     st.subheader(f"Dataframe: {key}")
-    st.dataframe(filtered_df)
\ No newline at end of file
+    st.dataframe(filtered_df)
+
+show_panel(perf_trace)
@@ -3,7 +3,6 @@ import pandas as pd
 
 import streamlit as st
 import os
-import boto3
 import json
 import pandas as pd
 import ijson
@@ -11,22 +10,20 @@ from datetime import datetime, timezone
 from io import BytesIO,StringIO
 import pickle
 
-@st.cache_data
-def load_data(bucket, object_key, access_key, secret_key, region):
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        region_name=region
-    )
-    csv_buffer = BytesIO()
-    s3.download_fileobj(bucket, object_key, csv_buffer)
-    csv_buffer.seek(0)
-    df = pd.read_csv(csv_buffer)
-    df.columns = [col.title().replace('_', ' ') for col in df.columns]
-    df['Biomas Tons'] /= 1000  # Convert Biomass Tons to Thousands
-    return df
-
+from biomass_data import BiomassQuery, build_cube, options, read_biomass_csv, rollup
+from perf import show_panel, start_page
+from s3_utils import cached_download, format_transfer, get_s3_client
+
+# cache_resource hands every session the same frame instead of a copy per call;
+# callers must treat it as read-only
+@st.cache_resource
+def load_data(bucket, object_key, access_key, secret_key, region, typed=True):
+    s3 = get_s3_client(access_key, secret_key, region)
+    # Read through the local disk cache (a miss downloads concurrent byte
+    # ranges) and parse straight from that buffer
+    csv_buffer, transfer_stats = cached_download(s3, bucket, object_key)
+    df = read_biomass_csv(csv_buffer, typed=typed)
+    return df, transfer_stats
 
 bucket_name = 'dev-data-layer-datasets'
 object_key = 'dashboard/biomassData.csv'
@@ -36,21 +33,34 @@ aws_secret_access_key = st.text_input("Enter your AWS secret access key")
 # wait for user to input the secret key before proceeding
 if aws_secret_access_key == "":
     st.stop()
+perf_trace = start_page("Residue")
+
+dfResidue, transfer_stats = load_data(bucket_name, object_key, aws_access_key_id, aws_secret_access_key, aws_default_region)
+st.caption(f"{format_transfer(transfer_stats)}; {dfResidue.memory_usage(deep=True).sum() / 1024 / 1024:.1f} MB in memory")
 
-dfResidue = load_data(bucket_name, object_key, aws_access_key_id, aws_secret_access_key, aws_default_region)
+@st.cache_resource(max_entries=2)
+def load_cube(_df, etag):
+    # Built once per version of the CSV; every view below rolls up from it
+    return build_cube(_df)
+
+dfCube = load_cube(dfResidue, transfer_stats['etag'])
 
 # I want State Rows and Source Columns and sum of Biomas Tons as Values
-dfResidueSum = dfResidue.groupby(['State', 'Source'])['Biomas Tons'].sum().reset_index()
-dfResidueSum = dfResidueSum.pivot(index='State', columns='Source', values='Biomas Tons').reset_index()
+dfResidueSum = rollup(dfCube, ['State', 'Source'])
+dfResidueSum = dfResidueSum.pivot(index='State', columns='Source', values='Biomas Tons')
+# Plain labels, so the 'State' column and 'Total' row can be added to the categorical axes
+dfResidueSum.index = dfResidueSum.index.astype(object)
+dfResidueSum.columns = dfResidueSum.columns.astype(object)
+dfResidueSum = dfResidueSum.reset_index()
 # add a total row
-dfResidueSum.loc['Total'] = dfResidueSum.sum()
+dfResidueSum.loc['Total'] = dfResidueSum.sum(numeric_only=True)
 dfResidueSum.loc['Total', 'State'] = 'Total'
 st.write("Total Residue",dfResidueSum)
 
 # Sidebar filtering functions
 def create_sidebar_filters(df):
-    source_options = df['Source'].unique()
-    state_options = df['State'].unique()
+    source_options = options(df['Source'])
+    state_options = options(df['State'])
 
     source_selection = st.sidebar.selectbox(
         "Select Detailed Source:",
@@ -64,39 +74,32 @@ def create_sidebar_filters(df):
 
     return source_selection, state_selection
 
-def filter_by_state(df, state_selection):
-    sector_options = df['Biomass Sector'].unique()
-    commodity_options = df['Biomass Commodity'].unique()
-    type_options = df['Biomass Type'].unique()
+def filter_by_state(query, state_selection):
+    sector_options = query.distinct('Biomass Sector')
+    commodity_options = query.distinct('Biomass Commodity')
+    type_options = query.distinct('Biomass Type')
 
     sector_selections = st.sidebar.multiselect("Biomass Sector", sector_options, default=sector_options)
     commodity_selections = st.sidebar.multiselect("Biomass Commodity", commodity_options, default=commodity_options)
     type_selections = st.sidebar.multiselect("Biomass Type", type_options, default=type_options)
 
-    df_filtered = df[
-        df['Biomass Sector'].isin(sector_selections) &
-        df['Biomass Commodity'].isin(commodity_selections) &
-        df['Biomass Type'].isin(type_selections)
-    ]
-
-    return df_filtered
+    return (query
+            .where_in('Biomass Sector', sector_selections)
+            .where_in('Biomass Commodity', commodity_selections)
+            .where_in('Biomass Type', type_selections))
 
-source_selection, state_selection = create_sidebar_filters(dfResidue)
+source_selection, state_selection = create_sidebar_filters(dfCube)
 
-df_filtered = dfResidue[
-    dfResidue['Source'].isin([source_selection]) &
-    dfResidue['State'].isin([state_selection])
-]
-
-df_filtered = filter_by_state(df_filtered, state_selection)
+# Filters are collected on a lazy query over the cube rows (one per distinct
+# group) and evaluated as one combined mask
+query = BiomassQuery(dfCube).where_in('Source', [source_selection]).where_in('State', [state_selection])
+query = filter_by_state(query, state_selection)
 
 # Sum and display total biomass in million tons
-total_biomass_million_tons = df_filtered['Biomas Tons'].sum() / 1000
+total_biomass_million_tons = query.total(having=False) / 1000
 st.write(f"Total Biomass: {total_biomass_million_tons:.3f} Million Tons")
 
 # Main page adjustments for Tons filter and group by functionality
-county_biomass = df_filtered.groupby('County')['Biomas Tons'].sum().reset_index()
-
 min_tons = st.number_input(
     "Enter Minimum Biomas Tons:",
     min_value=0,
@@ -104,22 +107,28 @@ min_tons = st.number_input(
     step=1
 )
 
-df_filtered = df_filtered[df_filtered['County'].isin(county_biomass[county_biomass['Biomas Tons'] >= min_tons]['County'])]
+# Counties whose filtered total reaches the minimum (a HAVING condition)
+df_filtered = query.having_min('County', min_tons).rows()
 st.write(f"Total Counties Satisfying Filter: {df_filtered['County'].nunique()}")
 
 group_by_columns = st.multiselect(
     "Select Columns to Group By:",
-    options=df_filtered.columns.tolist(),
+    options=[col for col in df_filtered.columns if col != 'Biomas Tons'],
     default=['State']
 )
 
 if group_by_columns:
-    df_grouped = df_filtered.groupby(group_by_columns).agg({'Biomas Tons': 'sum'}).reset_index()
+    df_grouped = rollup(df_filtered, group_by_columns)
     df_grouped = df_grouped.sort_values(by='Biomas Tons', ascending=False)
     st.write("Grouped by Selected Columns:", df_grouped)
 
 total_biomass = df_filtered['Biomas Tons'].sum()
-dfCounty = df_filtered.groupby('County')['Biomas Tons'].sum().reset_index().sort_values(by='Biomas Tons', ascending=False)
+dfCounty = rollup(df_filtered, ['County']).sort_values(by='Biomas Tons', ascending=False)
 dfCounty['Percent of State Total'] = dfCounty['Biomas Tons'] / total_biomass * 100
 st.write("Top 5 Counties by Biomass (in thousands of tons, percent of state total):", dfCounty.head(5))
-st.caption("Note: Percentages are calculated against the total biomass of the selected state, not just the top 5 or filtered counties.")
\ No newline at end of file
+st.caption("Note: Percentages are calculated against the total biomass of the selected state, not just the top 5 or filtered counties.")
+
+with st.expander("Query plan"):
+    st.text(query.explain())
+
+show_panel(perf_trace)
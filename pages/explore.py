@@ -1,8 +1,18 @@
 import streamlit as st
-import boto3
-import json
 from datetime import datetime, timezone
 
+from metadata_audit import METADATA_FORMAT
+from metadata_catalog import (
+    INDEX_FIELDS,
+    MetadataCatalog,
+    index_listing,
+    index_values,
+    load_metadata_index,
+    rebuild_metadata_index,
+)
+from perf import show_panel, start_page
+from s3_utils import get_s3_client
+
 aws_access_key_id = st.secrets["Access_key_ID"]
 aws_default_region = st.secrets["AWS_DEFAULT_REGION"]
 
@@ -10,76 +20,43 @@ aws_secret_access_key = st.text_input("Enter your AWS secret access key", type="
 if aws_secret_access_key == "":
     st.stop()
 
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=aws_access_key_id,
-    aws_secret_access_key=aws_secret_access_key,
-    region_name=aws_default_region
-)
+s3 = get_s3_client(aws_access_key_id, aws_secret_access_key, aws_default_region)
 bucket_name = 'dev-data-layer-datasets'
-
-def list_files_in_folder(bucket, prefix):
-    paginator = s3.get_paginator('list_objects_v2')
-    page_iterator = paginator.paginate(Bucket=bucket, Prefix=prefix)
-
-    files = []
-    for page in page_iterator:
-        if "Contents" in page:
-            for obj in page['Contents']:
-                files.append(obj['Key'])
-    return files
-
-def read_metadata(bucket, key):
-    response = s3.get_object(Bucket=bucket, Key=key)
-    json_text = response['Body'].read().decode('utf-8')
-    return json.loads(json_text)
-
-metadataFormat = {
-    "name": "",
-    "layer_id": "",
-    "geom_type": "",
-    "geom_join": "",
-    "description": "",
-    "obj_details_column": "",
-    "has_biomass": False,
-    "has_county_geoid": False,
-    "value_columns": [],
-    "category_columns": [],
-    "details_columns": [],
-    "data_columns": [],
-    "tooltip-title": "",
-    "tooltip-content": "",
-    "s3_file_path": "",
-    "view_name": "",
-    "updated_at": "",
-    "details_modals": [],
-    "columns": [],
-    "calculated_fields": [],
-    "human_identifier_field": "",
-    "mandatory_filter": [],
-    "layer_access_level": 2,
-    "supplier_layer": False,
-    "visualization": {}
-}
-
-def safe_get(dictionary, key, default=None):
-    return dictionary.get(key, default)
-
-folder_prefix = 'metadata/'
-files = list_files_in_folder(bucket_name, folder_prefix)
-json_files = [file for file in files if file.endswith('json') and file.count('/') == 1]
-
-keys = list(metadataFormat.keys())
+perf_trace = start_page("Explore")
+
+# Start from the consolidated metadata index (one GET). The full catalog is only
+# loaded for keys the index does not summarize, and is kept for the whole session
+# so switching keys never goes back to S3. Loads only fetch files whose ETag changed.
+refresh = st.sidebar.button("Refresh metadata")
+if 'metadata_index' not in st.session_state or refresh:
+    with st.spinner("Loading metadata index..."):
+        if refresh:
+            st.session_state.metadata_index = rebuild_metadata_index(s3, bucket_name)
+        else:
+            st.session_state.metadata_index = load_metadata_index(s3, bucket_name)
+metadata_index = st.session_state.metadata_index
+
+if 'metadata_catalog' not in st.session_state:
+    st.session_state.metadata_catalog = MetadataCatalog()
+catalog = st.session_state.metadata_catalog
+
+keys = list(METADATA_FORMAT.keys())
 
 selected_key = st.selectbox('Select a key', keys)
 
-values = {}
-for file in json_files:
-    metadata = read_metadata(bucket_name, file)
-    values[file] = safe_get(metadata, selected_key, "N/A")
+if selected_key in INDEX_FIELDS:
+    values = index_values(metadata_index, selected_key, "N/A")
+else:
+    with st.spinner("Loading metadata..."):
+        updated = catalog.refresh(s3, bucket_name, listing=index_listing(metadata_index))
+    if updated:
+        st.sidebar.caption(f"{len(catalog)} layers, {updated} downloaded")
+    values = catalog.values_for(selected_key, "N/A")
 
 st.subheader(f"Values for '{selected_key}'")
 for key, value in values.items():
     st.write(f"**{key}**")
     st.write(value)
     st.write('---')
+
+show_panel(perf_trace)
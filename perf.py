@@ -0,0 +1,318 @@
+"""
+Timing spans and counters for the app's hot paths: S3 calls, parsing,
+aggregation and map rendering.
+
+Recording happens only while a rerun is being traced, which a page turns on
+with `start_page` when PERF_PANEL or PERF_LOG is set, or for one session
+with the ?perf=1 query parameter. Otherwise `span` returns one shared no-op
+context manager and `count` returns at once, so the instrumentation left in
+place costs a context variable lookup per call.
+
+A finished trace is shown as a sidebar panel and/or written as JSON lines,
+one per span plus one per rerun, to stderr (PERF_LOG=1) or appended to the
+file PERF_LOG names.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+PERF_PANEL = os.environ.get('PERF_PANEL', '') not in ('', '0')
+PERF_LOG = os.environ.get('PERF_LOG', '')
+if PERF_LOG == '0':
+    PERF_LOG = ''
+
+_trace = contextvars.ContextVar('perf_trace', default=None)
+_depth = contextvars.ContextVar('perf_depth', default=0)
+_logger = None
+
+
+class Trace:
+    """
+    Spans and counters of one rerun. Spans may be added from any thread.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.spans = []
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, start, seconds, depth=0, **fields):
+        span = {'name': name, 'start_ms': round((start - self.started) * 1000, 3), 'ms': round(seconds * 1000, 3),
+                'depth': depth}
+        span.update(fields)
+        with self.lock:
+            self.spans.append(span)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def totals(self):
+        """
+        {span name: (calls, total ms)}, in order of first appearance.
+        """
+        totals = {}
+        with self.lock:
+            for span in self.spans:
+                calls, ms = totals.get(span['name'], (0, 0.0))
+                totals[span['name']] = (calls + 1, ms + span['ms'])
+        return totals
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'fields', 'depth', 'token', 'start')
+
+    def __init__(self, trace, name, fields):
+        self.trace = trace
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        # Details only known once the work is done, e.g. rows produced
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.depth = _depth.get()
+        self.token = _depth.set(self.depth + 1)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _depth.reset(self.token)
+        if exc_type is not None:
+            self.fields['error'] = exc_type.__name__
+        self.trace.add(self.name, self.start, seconds, self.depth, **self.fields)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def current():
+    return _trace.get()
+
+
+def span(name, **fields):
+    """
+    Context manager timing a block as `name` in the current trace.
+    """
+    trace = _trace.get()
+    if trace is None:
+        return NULL_SPAN
+    return Span(trace, name, fields)
+
+
+def count(name, value=1):
+    trace = _trace.get()
+    if trace is not None:
+        trace.count(name, value)
+
+
+def record(name, start, seconds, **fields):
+    """
+    Add a span timed by the caller, `start` being a time.perf_counter() value.
+    """
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(name, start, seconds, _depth.get(), **fields)
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as a span.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            trace = _trace.get()
+            if trace is None:
+                return function(*args, **kwargs)
+            with Span(trace, name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(function):
+    """
+    `function` carrying the current trace into the worker threads of a pool,
+    which do not inherit context variables. Returned as is when not tracing.
+    """
+    trace = _trace.get()
+    if trace is None:
+        return function
+    depth = _depth.get()
+
+    def bound(*args, **kwargs):
+        trace_token, depth_token = _trace.set(trace), _depth.set(depth)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _depth.reset(depth_token)
+            _trace.reset(trace_token)
+    return bound
+
+
+def start(name):
+    """
+    Begin tracing the rest of this thread's work as `name`.
+    """
+    trace = Trace(name)
+    _trace.set(trace)
+    _depth.set(0)
+    return trace
+
+
+def stop():
+    _trace.set(None)
+
+
+def finish(trace):
+    """
+    Close `trace`, stop tracing and write its log lines when PERF_LOG is set.
+    """
+    trace.seconds = time.perf_counter() - trace.started
+    stop()
+    if PERF_LOG:
+        log_trace(trace)
+    return trace
+
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        logger = logging.getLogger('perf')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = logging.StreamHandler(sys.stderr) if PERF_LOG == '1' else logging.FileHandler(PERF_LOG)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        _logger = logger
+    return _logger
+
+
+def log_trace(trace):
+    logger = _get_logger()
+    common = {'trace': trace.id, 'page': trace.name}
+    with trace.lock:
+        spans = list(trace.spans)
+        counters = dict(trace.counters)
+    for span in spans:
+        logger.info(json.dumps({'event': 'span', **common, **span}, default=str))
+    logger.info(json.dumps({'event': 'rerun', **common, 'timestamp': trace.timestamp,
+                            'ms': (trace.seconds or 0) * 1000, 'spans': len(spans), 'counters': counters},
+                           default=str))
+
+
+# S3 instrumentation
+
+def _before_s3_call(params, context, **kwargs):
+    if _trace.get() is None:
+        return
+    context['perf_start'] = time.perf_counter()
+    body = params.get('body')
+    context['perf_bytes_out'] = len(body) if isinstance(body, (bytes, bytearray, str)) else 0
+
+
+def _after_s3_call(event_name, context, parsed=None, exception=None, **kwargs):
+    trace = _trace.get()
+    start_time = context.get('perf_start')
+    if trace is None or start_time is None:
+        return
+    seconds = time.perf_counter() - start_time
+    # after-call.s3.GetObject -> GetObject
+    operation = event_name.rsplit('.', 1)[-1]
+    fields = {}
+    if parsed is not None:
+        metadata = parsed.get('ResponseMetadata', {})
+        fields['status'] = metadata.get('HTTPStatusCode')
+        fields['retries'] = metadata.get('RetryAttempts', 0)
+        if operation == 'GetObject' and fields['status'] in (200, 206):
+            fields['bytes_in'] = parsed.get('ContentLength', 0)
+        if operation == 'ListObjectsV2':
+            fields['keys'] = parsed.get('KeyCount', 0)
+    if exception is not None:
+        fields['error'] = type(exception).__name__
+    if context.get('perf_bytes_out'):
+        fields['bytes_out'] = context['perf_bytes_out']
+    trace.add(f's3.{operation}', start_time, seconds, _depth.get(), **fields)
+    trace.count('s3.requests')
+    for name in ('bytes_in', 'bytes_out', 'retries'):
+        if fields.get(name):
+            trace.count(f's3.{name}', fields[name])
+
+
+def instrument_s3(client):
+    """
+    Record a span per request made by a boto3 S3 client while tracing, with
+    its status, retries and the bytes sent and received.
+    """
+    events = client.meta.events
+    events.register('before-call.s3', _before_s3_call)
+    events.register('after-call.s3', _after_s3_call)
+    events.register('after-call-error.s3', _after_s3_call)
+    return client
+
+
+# Streamlit
+
+def start_page(name):
+    """
+    Begin tracing a page's rerun when the panel or the log is on for it.
+    Returns the trace, or None when not tracing.
+    """
+    import streamlit as st
+    if PERF_PANEL or PERF_LOG or st.query_params.get('perf') == '1':
+        return start(name)
+    stop()
+    return None
+
+
+def show_panel(trace):
+    """
+    Finish a page's trace and show it in the sidebar, when the panel is on.
+    """
+    if trace is None:
+        return
+    import streamlit as st
+    finish(trace)
+    if not (PERF_PANEL or st.query_params.get('perf') == '1'):
+        return
+    with st.sidebar.expander(f"Performance: {trace.seconds * 1000:,.0f} ms", expanded=False):
+        rows = [
+            {'span': '  ' * span['depth'] + span['name'], 'ms': round(span['ms'], 1),
+             'details': ', '.join(f'{key}={value}' for key, value in span.items()
+                                  if key not in ('name', 'start_ms', 'ms', 'depth'))}
+            for span in sorted(trace.spans, key=lambda span: span['start_ms'])
+        ]
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+        totals = trace.totals()
+        st.dataframe([{'span': name, 'calls': calls, 'ms': round(ms, 1)} for name, (calls, ms) in totals.items()],
+                     hide_index=True, use_container_width=True)
+        if trace.counters:
+            st.json(trace.counters)
@@ -0,0 +1,118 @@
+"""
+Process-wide cache of parsed uploads and finished maps for Symbology.py,
+bounded by an estimate of the memory its entries hold.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+
+from map_layers import point_coordinates
+
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 1024 ** 3))
+# Rough per-geometry cost on top of its coordinates
+GEOMETRY_OVERHEAD = 100
+
+
+class RenderCache:
+    """
+    Least recently used cache with a byte budget.
+
+    `get` returns the cached value for a key or builds it with `build()`,
+    sized by `size(value)`. Building happens outside the lock, so two
+    sessions missing the same key at once may both build it. None is never
+    cached, and neither is a value larger than the whole budget.
+    """
+
+    def __init__(self, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, build, size):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        value = build()
+        if value is None:
+            return value
+        nbytes = size(value)
+        with self.lock:
+            if nbytes <= self.max_bytes:
+                if key in self.entries:
+                    self.bytes -= self.entries.pop(key)[1]
+                self.entries[key] = (value, nbytes)
+                self.bytes += nbytes
+                while self.bytes > self.max_bytes:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.bytes -= evicted
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+render_cache = RenderCache()
+
+
+def frame_bytes(geo_df):
+    """
+    Estimated memory held by a GeoDataFrame, geometries included.
+    """
+    geometry = geo_df.geometry.to_numpy()
+    size = int(geo_df.drop(columns=geo_df.geometry.name).memory_usage(deep=True).sum())
+    return size + len(geometry) * GEOMETRY_OVERHEAD + int(shapely.get_num_coordinates(geometry).sum()) * 16
+
+
+class UploadedDataset:
+    """
+    A parsed upload with what every render of it needs precomputed: the
+    feature positions (representative points for lines and polygons), the
+    bounds and the center. `key` identifies the upload in cache keys.
+    """
+
+    def __init__(self, key, geo_df, lat=None, lon=None):
+        self.key = key
+        self.geo_df = geo_df
+        if lat is None:
+            lat, lon = point_coordinates(geo_df)
+        self.lat, self.lon = lat, lon
+        finite = np.isfinite(lat) & np.isfinite(lon)
+        if finite.any():
+            # (south, west, north, east), like a map view
+            self.bounds = (float(lat[finite].min()), float(lon[finite].min()),
+                           float(lat[finite].max()), float(lon[finite].max()))
+            self.center = [float(lat[finite].mean()), float(lon[finite].mean())]
+        else:
+            self.bounds, self.center = None, [0.0, 0.0]
+
+    def with_column(self, name, values):
+        """
+        The same features with one more property column.
+        """
+        return UploadedDataset(self.key, self.geo_df.assign(**{name: values}), self.lat, self.lon)
+
+    def nbytes(self):
+        return frame_bytes(self.geo_df) + self.lat.nbytes + self.lon.nbytes
+
+
+def map_bytes(entry):
+    """
+    Estimated size of a cached (map, notes) entry, from the layer data it holds.
+    """
+    m, _ = entry
+    size = 1024
+    for child in m._children.values():
+        data = getattr(child, 'data', None)
+        size += len(data) if isinstance(data, str) else 32 * len(data or ())
+    return size
@@ -0,0 +1,387 @@
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import perf
+
+# Shared client settings. The pool must be at least as large as the number of
+# concurrent requests a page makes (ranged downloads, metadata fan-out).
+MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32))
+CONNECT_TIMEOUT = float(os.environ.get('S3_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('S3_READ_TIMEOUT', 60))
+MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', 5))
+
+# Ranged download defaults: objects larger than one part are fetched as
+# concurrent byte ranges
+PART_SIZE = 8 * 1024 * 1024
+MAX_CONCURRENCY = 8
+
+# Local object cache, shared by every page served from this machine
+CACHE_DIR = os.environ.get('S3_CACHE_DIR', os.path.join(tempfile.gettempdir(), 's3-object-cache'))
+CACHE_MAX_BYTES = int(os.environ.get('S3_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_s3_client(access_key, secret_key, region, max_pool_connections=MAX_POOL_CONNECTIONS,
+                  connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+    """
+    Return the process-wide S3 client for these credentials and settings.
+
+    Clients are built once and reused by every page, rerun and session, so
+    their HTTP connection pools stay warm. boto3 clients are thread-safe.
+    """
+    settings = (max_pool_connections, connect_timeout, read_timeout, max_attempts)
+    registry_key = (access_key, hashlib.sha256(secret_key.encode('utf-8')).hexdigest(), region, settings)
+    with _clients_lock:
+        client = _clients.get(registry_key)
+        if client is None:
+            config = Config(
+                max_pool_connections=max_pool_connections,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                retries={'max_attempts': max_attempts, 'mode': 'standard'},
+            )
+            # A session per client: the default boto3 session is not thread-safe
+            client = boto3.session.Session().client(
+                's3',
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                region_name=region,
+                config=config
+            )
+            # Requests are timed while a page is traced; otherwise the hooks return at once
+            perf.instrument_s3(client)
+            _clients[registry_key] = client
+    return client
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only file object over a buffer, so parsers that want a file
+    (pd.read_csv, pickle.load) can consume a download without copying it.
+    """
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer).cast('B')
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        chunk = self.view[self.position:self.position + len(target)]
+        target[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = len(self.view) + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+def _download_range(s3, bucket, key, etag, write, start, length):
+    # If-Match makes every part come from the same version of the object
+    end = start + length - 1
+    response = s3.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}', IfMatch=etag)
+    position = start
+    for chunk in response['Body'].iter_chunks(1024 * 1024):
+        write(position, chunk)
+        position += len(chunk)
+    if position != start + length:
+        raise IOError(f"Short read for s3://{bucket}/{key} bytes {start}-{end}: got {position - start} bytes")
+
+
+def _download_into(s3, bucket, key, etag, size, write, part_size, max_concurrency):
+    """
+    Fetch `size` bytes of an object as concurrent ranges, handing each chunk
+    to `write(offset, chunk)`. Returns the number of parts.
+    """
+    offsets = list(range(0, size, part_size))
+    if len(offsets) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(offsets))) as pool:
+            futures = [
+                pool.submit(perf.bind(_download_range), s3, bucket, key, etag, write, start,
+                            min(part_size, size - start))
+                for start in offsets
+            ]
+            for future in futures:
+                future.result()
+    elif size:
+        _download_range(s3, bucket, key, etag, write, 0, size)
+    return len(offsets)
+
+
+def _transfer_stats(key, etag, size, parts, start_time, cache=None):
+    elapsed = time.perf_counter() - start_time
+    return {
+        'key': key,
+        'etag': etag,
+        'bytes': size,
+        'parts': parts,
+        'seconds': elapsed,
+        'mb_per_second': size / 1024 / 1024 / elapsed if elapsed else 0.0,
+        'cache': cache,
+    }
+
+
+def download_object(s3, bucket, key, part_size=PART_SIZE, max_concurrency=MAX_CONCURRENCY):
+    """
+    Download an object into a single preallocated buffer, fetching byte ranges
+    of `part_size` concurrently.
+
+    Returns (buffer, stats). `buffer` is a bytearray that pickle.loads accepts
+    directly and BufferReader wraps for file-based parsers; `stats` holds the
+    size, part count, elapsed seconds and throughput in MB/s.
+    """
+    start_time = time.perf_counter()
+    head = s3.head_object(Bucket=bucket, Key=key)
+    buffer, parts = _download_buffer(s3, bucket, key, head, part_size, max_concurrency)
+    return buffer, _transfer_stats(key, head['ETag'], len(buffer), parts, start_time)
+
+
+def _download_buffer(s3, bucket, key, head, part_size, max_concurrency):
+    # The object described by `head`, in memory; returns (buffer, parts)
+    buffer = bytearray(head['ContentLength'])
+    view = memoryview(buffer)
+
+    def write(offset, chunk):
+        view[offset:offset + len(chunk)] = chunk
+
+    parts = _download_into(s3, bucket, key, head['ETag'], len(buffer), write, part_size, max_concurrency)
+    return buffer, parts
+
+
+def _is_not_modified(error):
+    return error.response['Error']['Code'] in ('304', 'NotModified')
+
+
+class DiskCache:
+    """
+    Local disk cache of S3 objects keyed by bucket/key/ETag.
+
+    Every read revalidates the cached version with a conditional HEAD
+    (If-None-Match), so a hit costs one small request and no transfer. Files
+    are evicted least recently used first once the cache outgrows `max_bytes`,
+    and hits are served as read-only memory maps.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def _entry_dir(self, bucket, key):
+        return os.path.join(self.directory, hashlib.sha256(f'{bucket}/{key}'.encode('utf-8')).hexdigest())
+
+    def cached_etag(self, bucket, key):
+        """
+        Return the ETag of the cached version of an object, or None.
+        """
+        entry_dir = self._entry_dir(bucket, key)
+        try:
+            names = [name for name in os.listdir(entry_dir) if not name.startswith('.')]
+        except FileNotFoundError:
+            return None
+        return f'"{names[0]}"' if names else None
+
+    def _path(self, bucket, key, etag):
+        return os.path.join(self._entry_dir(bucket, key), etag.strip('"'))
+
+    def revalidate(self, s3, bucket, key):
+        """
+        Return (etag, head). `etag` is the cached ETag if it is still current,
+        otherwise None and `head` describes the current object.
+        """
+        etag = self.cached_etag(bucket, key)
+        try:
+            if etag is None:
+                return None, s3.head_object(Bucket=bucket, Key=key)
+            return None, s3.head_object(Bucket=bucket, Key=key, IfNoneMatch=etag)
+        except ClientError as e:
+            if etag is not None and _is_not_modified(e):
+                return etag, None
+            raise
+
+    def read(self, bucket, key, etag):
+        path = self._path(bucket, key, etag)
+        os.utime(path)  # mtime doubles as the LRU clock
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def store(self, s3, bucket, key, head, part_size=PART_SIZE, max_concurrency=MAX_CONCURRENCY):
+        """
+        Download the object described by `head` into the cache, replacing
+        older versions, and return the number of parts fetched.
+        """
+        entry_dir = self._entry_dir(bucket, key)
+        os.makedirs(entry_dir, exist_ok=True)
+        size = head['ContentLength']
+        # Write to a hidden temporary file so readers never see a partial object
+        partial = os.path.join(entry_dir, f'.{uuid.uuid4().hex}.part')
+        try:
+            with open(partial, 'wb') as f:
+                f.truncate(size)
+                fd = f.fileno()
+
+                def write(offset, chunk):
+                    view = memoryview(chunk)
+                    while view:
+                        written = os.pwrite(fd, view, offset)
+                        view = view[written:]
+                        offset += written
+
+                parts = _download_into(s3, bucket, key, head['ETag'], size, write, part_size, max_concurrency)
+            os.replace(partial, self._path(bucket, key, head['ETag']))
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+        current = head['ETag'].strip('"')
+        for name in os.listdir(entry_dir):
+            if name != current and not name.startswith('.'):
+                try:
+                    os.remove(os.path.join(entry_dir, name))
+                except FileNotFoundError:
+                    pass
+        self.evict(keep=self._path(bucket, key, head['ETag']))
+        return parts
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used files until the cache fits `max_bytes`,
+        never the file at `keep` (the one just stored).
+        """
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.directory):
+                if not entry.is_dir():
+                    continue
+                for item in os.scandir(entry.path):
+                    if not item.name.startswith('.'):
+                        stat = item.stat()
+                        files.append((stat.st_mtime, stat.st_size, item.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def fetch(self, s3, bucket, key, part_size=PART_SIZE, max_concurrency=MAX_CONCURRENCY):
+        """
+        Return (buffer, stats) like download_object, with `buffer` a read-only
+        memory map of the cached file and stats['cache'] one of "hit", "miss"
+        or "refresh". Objects larger than the whole cache, or evicted by
+        another process before they could be read, are returned in memory
+        instead, as "bypass".
+        """
+        start_time = time.perf_counter()
+        had_copy = self.cached_etag(bucket, key) is not None
+        etag, head = self.revalidate(s3, bucket, key)
+        if etag is not None:
+            try:
+                buffer = self.read(bucket, key, etag)
+                return buffer, _transfer_stats(key, etag, len(buffer), 0, start_time, 'hit')
+            except FileNotFoundError:
+                # Evicted between the revalidation and the read
+                head = s3.head_object(Bucket=bucket, Key=key)
+
+        if head['ContentLength'] <= self.max_bytes:
+            parts = self.store(s3, bucket, key, head, part_size, max_concurrency)
+            try:
+                buffer = self.read(bucket, key, head['ETag'])
+                status = 'refresh' if had_copy else 'miss'
+                return buffer, _transfer_stats(key, head['ETag'], len(buffer), parts, start_time, status)
+            except FileNotFoundError:
+                # Evicted by another process before the read
+                pass
+        buffer, parts = _download_buffer(s3, bucket, key, head, part_size, max_concurrency)
+        return buffer, _transfer_stats(key, head['ETag'], len(buffer), parts, start_time, 'bypass')
+
+
+object_cache = DiskCache()
+
+
+def cached_download(s3, bucket, key, part_size=PART_SIZE, max_concurrency=MAX_CONCURRENCY):
+    """
+    download_object through the shared disk cache.
+    """
+    with perf.span('s3.download', key=key) as span:
+        buffer, stats = object_cache.fetch(s3, bucket, key, part_size, max_concurrency)
+        span.set(bytes=stats['bytes'], parts=stats['parts'], cache=stats['cache'])
+    return buffer, stats
+
+
+def list_keys(s3, bucket, prefix):
+    """
+    Every object key under `prefix`, following the listing's pagination.
+    """
+    paginator = s3.get_paginator('list_objects_v2')
+    keys = []
+    with perf.span('s3.list', prefix=prefix) as span:
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                keys.append(obj['Key'])
+        span.set(keys=len(keys))
+    return keys
+
+
+def open_object(s3, bucket, key, download=True):
+    """
+    Return (file object, etag) for reading an object from start to end.
+
+    With `download`, the object is brought into the disk cache first and read
+    from there. Without it, a current cached copy is still used, but a miss
+    streams straight from S3 so partial reads do not pull the whole object.
+    """
+    if download:
+        buffer, stats = cached_download(s3, bucket, key)
+        return BufferReader(buffer), stats['etag']
+    etag, _ = object_cache.revalidate(s3, bucket, key)
+    if etag is not None:
+        try:
+            return BufferReader(object_cache.read(bucket, key, etag)), etag
+        except FileNotFoundError:
+            # Evicted since the revalidation; stream it like a miss
+            pass
+    response = s3.get_object(Bucket=bucket, Key=key)
+    return response['Body'], response['ETag']
+
+
+def format_transfer(stats):
+    if stats.get('cache') == 'hit':
+        return f"Loaded {stats['bytes'] / 1024 / 1024:.1f} MB from the local cache ({stats['seconds']:.2f} s)"
+    return (f"Downloaded {stats['bytes'] / 1024 / 1024:.1f} MB in {stats['parts']} parts, "
+            f"{stats['seconds']:.2f} s ({stats['mb_per_second']:.1f} MB/s)")
@@ -0,0 +1,354 @@
+"""
+Zoom-level indexes over point coordinates for Symbology.py. Points are
+projected to Web Mercator once, so each map view is answered from
+precomputed arrays instead of sending every feature to the browser.
+"""
+import numpy as np
+import shapely
+from shapely.geometry import box
+
+TILE_SIZE = 256
+MAX_ZOOM = 18
+# Width of a cluster cell on screen; a power of two so cells nest across zooms
+CLUSTER_PIXELS = 64
+MAX_LATITUDE = 85.05112878
+# Heat map cell width on screen
+HEAT_PIXELS = 12
+HEAT_GRIDS = ["Square", "Hexagon"]
+# Zoomed out, at most one feature is drawn per cell of this many pixels
+THIN_PIXELS = 3
+# Zooms with a precomputed line and polygon simplification
+LOD_ZOOMS = [4, 7, 10, 13]
+
+
+def mercator(lat, lon):
+    """
+    Normalized Web Mercator coordinates: x and y in [0, 1], y growing south.
+    """
+    x = (np.asarray(lon, dtype=float) + 180) / 360
+    sin = np.sin(np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)))
+    y = 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)
+    return x, y
+
+
+def inverse_mercator(x, y):
+    """
+    (lat, lon) of normalized Web Mercator coordinates.
+    """
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y, dtype=float)))))
+    return lat, np.asarray(x, dtype=float) * 360 - 180
+
+
+def grid_cells(x, y, cells):
+    """
+    Integer (column, row) of each point on a `cells` x `cells` grid.
+    """
+    column = np.clip((x * cells).astype(np.int64), 0, cells - 1)
+    row = np.clip((y * cells).astype(np.int64), 0, cells - 1)
+    return column, row
+
+
+def _spread_bits(v):
+    # Move the low 32 bits of v to the even bit positions
+    v = v.astype(np.uint64)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton(column, row):
+    """
+    Z-order code of grid cells. Dropping the two lowest bits gives the code
+    of the enclosing cell one zoom level up.
+    """
+    return _spread_bits(column) | (_spread_bits(row) << np.uint64(1))
+
+
+def viewport(center, zoom, width, height):
+    """
+    Approximate (south, west, north, east) of a `width` x `height` pixel map
+    at `center` (lat, lon) and `zoom`, for views the browser has not
+    reported yet.
+    """
+    x, y = mercator(center[0], center[1])
+    scale = TILE_SIZE * 2 ** zoom
+    half_x, half_y = width / 2 / scale, height / 2 / scale
+    north, west = inverse_mercator(x - half_x, y - half_y)
+    south, east = inverse_mercator(x + half_x, y + half_y)
+    return float(south), float(west), float(north), float(east)
+
+
+def fit_zoom(bounds, width, height, max_zoom=MAX_ZOOM):
+    """
+    Largest zoom at which (south, west, north, east) fits a `width` x
+    `height` pixel map.
+    """
+    south, west, north, east = bounds
+    x0, y0 = mercator(north, west)
+    x1, y1 = mercator(south, east)
+    span = max((x1 - x0) / width, (y1 - y0) / height) * TILE_SIZE
+    if span <= 0:
+        return max_zoom
+    return int(min(max(np.floor(-np.log2(span)), 0), max_zoom))
+
+
+def pixel_degrees(zoom):
+    """
+    Width of one screen pixel at `zoom`, in degrees of longitude.
+    """
+    return 360 / (TILE_SIZE * 2 ** zoom)
+
+
+def in_bounds(lat, lon, bounds, margin=0.5):
+    """
+    Mask of the points inside (south, west, north, east), grown by `margin`
+    times its size on every side so small pans do not uncover empty space.
+    """
+    south, west, north, east = bounds
+    pad_lat, pad_lon = (north - south) * margin, (east - west) * margin
+    return ((lat >= south - pad_lat) & (lat <= north + pad_lat)
+            & (lon >= west - pad_lon) & (lon <= east + pad_lon))
+
+
+class ViewportIndex:
+    """
+    Features of a GeoDataFrame that are worth drawing in a view.
+
+    The STR tree (geopandas' sindex, built once and kept with the frame)
+    finds the features intersecting the padded view. Zoomed out, points are
+    thinned to the first one per `thin_pixels` screen cell, since points
+    sharing a few pixels are drawn on top of each other anyway; lines and
+    polygons are all kept, as dropping them would leave holes, and are
+    simplified by GeometryLevels instead.
+    """
+
+    def __init__(self, geo_df, lat, lon, thin_pixels=THIN_PIXELS):
+        self.tree = geo_df.sindex
+        self.x, self.y = mercator(lat, lon)
+        self.is_point = shapely.get_type_id(geo_df.geometry.to_numpy()) == 0
+        self.thin_pixels = thin_pixels
+
+    def query(self, zoom, bounds):
+        """
+        Sorted positions of the features to draw at `zoom` within `bounds`.
+        """
+        south, west, north, east = bounds
+        pad_lat, pad_lon = (north - south) / 2, (east - west) / 2
+        window = box(west - pad_lon, south - pad_lat, east + pad_lon, north + pad_lat)
+        candidates = np.sort(self.tree.query(window))
+        x, y = self.x[candidates], self.y[candidates]
+        # Features without a position cannot be drawn
+        candidates = candidates[np.isfinite(x) & np.isfinite(y)]
+        points = candidates[self.is_point[candidates]]
+        cells = int(TILE_SIZE * 2 ** zoom // self.thin_pixels) or 1
+        column, row = grid_cells(self.x[points], self.y[points], cells)
+        _, first = np.unique(column * cells + row, return_index=True)
+        return np.sort(np.concatenate([points[first], candidates[~self.is_point[candidates]]]))
+
+
+class ClusterIndex:
+    """
+    Grid clusters of a point set for every zoom level 0..`max_zoom`.
+
+    Points are sorted once by the Z-order code of their cell at `max_zoom`,
+    which makes every cell at every coarser zoom a contiguous run. A level is
+    stored as the start offsets of its runs, derived from the level below by
+    keeping the starts whose parent cell changes, and running sums of the
+    coordinates give each cluster's count and centroid without touching the
+    points again.
+    """
+
+    def __init__(self, lat, lon, max_zoom=MAX_ZOOM, cell_pixels=CLUSTER_PIXELS):
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        lat, lon = lat[valid], lon[valid]
+        self.max_zoom = max_zoom
+
+        cells = TILE_SIZE * 2 ** max_zoom // cell_pixels
+        code = morton(*grid_cells(*mercator(lat, lon), cells))
+        order = np.argsort(code, kind='stable')
+        code = code[order]
+        self.size = len(code)
+        self.lat_sum = np.concatenate([[0.0], np.cumsum(lat[order])])
+        self.lon_sum = np.concatenate([[0.0], np.cumsum(lon[order])])
+
+        self.starts = {}
+        starts = np.flatnonzero(np.r_[True, code[1:] != code[:-1]]) if len(code) else np.array([], dtype=np.int64)
+        for zoom in range(max_zoom, -1, -1):
+            self.starts[zoom] = starts
+            parent = code[starts] >> np.uint64(2 * (max_zoom - zoom + 1))
+            starts = starts[np.r_[True, parent[1:] != parent[:-1]]] if len(starts) else starts
+
+    def clusters(self, zoom, bounds=None):
+        """
+        (lat, lon, count) arrays of the clusters at `zoom`, limited to those
+        near `bounds` (south, west, north, east) when given.
+        """
+        starts = self.starts[int(min(max(zoom, 0), self.max_zoom))]
+        ends = np.append(starts[1:], self.size)
+        count = ends - starts
+        lat = (self.lat_sum[ends] - self.lat_sum[starts]) / count
+        lon = (self.lon_sum[ends] - self.lon_sum[starts]) / count
+        if bounds is not None:
+            visible = in_bounds(lat, lon, bounds)
+            lat, lon, count = lat[visible], lon[visible], count[visible]
+        return lat, lon, count
+
+
+def hex_cells(px, py, size):
+    """
+    (column, row) of the pointy-top hexagon of width `size` holding each
+    pixel position; odd rows are shifted half a hexagon right. Each point
+    is assigned to the nearer center of two offset rectangular lattices.
+    """
+    dx, dy = size, size * np.sqrt(3) / 2
+    fy = py / dy
+    row = np.round(fy).astype(np.int64)
+    fx = px / dx - (row & 1) / 2
+    column = np.round(fx).astype(np.int64)
+    # Near the slanted edges the neighbouring row's center may be closer
+    y1 = fy - row
+    row2 = row + np.where(fy < row, -1, 1)
+    fx2 = px / dx - (row2 & 1) / 2
+    column2 = np.round(fx2).astype(np.int64)
+    d1 = (fx - column) ** 2 + (y1 * dy / dx) ** 2
+    d2 = (fx2 - column2) ** 2 + ((fy - row2) * dy / dx) ** 2
+    other = (np.abs(y1) * 3 > 1) & (d2 < d1)
+    return np.where(other, column2, column), np.where(other, row2, row)
+
+
+def gaussian_smooth(grid, sigma):
+    """
+    Separable Gaussian kernel density smoothing of a 2-D grid, `sigma` in cells.
+    """
+    radius = max(int(3 * sigma), 1)
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    kernel /= kernel.sum()
+    padded = np.pad(grid, radius)
+    # Sliding windows along each axis, weighted by the kernel
+    rows = np.lib.stride_tricks.sliding_window_view(padded, len(kernel), axis=0) @ kernel
+    return np.lib.stride_tricks.sliding_window_view(rows, len(kernel), axis=1) @ kernel
+
+
+class HeatIndex:
+    """
+    Weighted points binned for a heat map at any zoom.
+
+    Positions are projected once. For a view, the points near its bounds
+    are histogrammed with one bincount onto a square or hexagon grid of
+    `cell_pixels` screen cells, optionally smoothed, and only the non-empty
+    cells are returned.
+    """
+
+    def __init__(self, lat, lon, weight):
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        weight = np.asarray(weight, dtype=float)
+        valid = np.isfinite(lat) & np.isfinite(lon) & np.isfinite(weight)
+        self.lat, self.lon = lat[valid], lon[valid]
+        self.x, self.y = mercator(self.lat, self.lon)
+        # Heat intensity cannot be negative
+        self.weight = np.clip(weight[valid], 0, None)
+
+    def bins(self, zoom, bounds, cell_pixels=HEAT_PIXELS, grid="Square", smoothing=0):
+        """
+        (lat, lon, intensity) of the non-empty cells near `bounds` at `zoom`,
+        intensity scaled to a maximum of 1. `smoothing` is the KDE bandwidth
+        in cells (0 for none).
+        """
+        if grid not in HEAT_GRIDS:
+            raise ValueError(f"Unknown heat map grid {grid!r}, expected one of {HEAT_GRIDS}")
+        south, west, north, east = bounds
+        pad_lat, pad_lon = (north - south) / 2, (east - west) / 2
+        window = in_bounds(self.lat, self.lon, bounds)
+        scale = TILE_SIZE * 2 ** zoom
+        x0, y0 = mercator(min(north + pad_lat, MAX_LATITUDE), west - pad_lon)
+        x1, y1 = mercator(max(south - pad_lat, -MAX_LATITUDE), east + pad_lon)
+        px = (self.x[window] - x0) * scale
+        py = (self.y[window] - y0) * scale
+        width, height = (x1 - x0) * scale, (y1 - y0) * scale
+
+        if grid == "Square":
+            column = (px // cell_pixels).astype(np.int64)
+            row = (py // cell_pixels).astype(np.int64)
+        else:
+            column, row = hex_cells(px, py, cell_pixels)
+        # One spare cell on every side for hexagons straddling the window edge
+        row_height = cell_pixels if grid == "Square" else cell_pixels * np.sqrt(3) / 2
+        columns = int(width // cell_pixels) + 3
+        rows = int(height // row_height) + 3
+        column = np.clip(column + 1, 0, columns - 1)
+        row = np.clip(row + 1, 0, rows - 1)
+        dense = np.bincount(row * columns + column, weights=self.weight[window],
+                            minlength=rows * columns).reshape(rows, columns)
+        if smoothing:
+            dense = gaussian_smooth(dense, smoothing)
+
+        peak = dense.max() if dense.size and dense.max() > 0 else 1
+        # Smoothing leaves a faint tail over the whole grid; it is not drawn
+        row, column = np.nonzero(dense > (peak * 1e-3 if smoothing else 0))
+        value = dense[row, column]
+        column, row = column - 1, row - 1
+        if grid == "Square":
+            cx, cy = (column + 0.5) * cell_pixels, (row + 0.5) * cell_pixels
+        else:
+            cx, cy = (column + (row & 1) / 2) * cell_pixels, row * row_height
+        lat, lon = inverse_mercator(x0 + cx / scale, y0 + cy / scale)
+        return lat, lon, value / peak
+
+
+class GeometryLevels:
+    """
+    Lines and polygons of a dataset at several levels of detail.
+
+    For each of `zooms` the shapes are simplified to about one pixel at
+    that zoom (preserving the topology of each geometry), their coordinates
+    rounded to a quarter pixel for a shorter payload (which may leave a
+    sliver invalid; the levels are only drawn), and the result serialized
+    to GeoJSON once. A view uses
+    the coarsest level that is still exact to a pixel at its zoom; beyond
+    the last level the full geometry is serialized, on first use.
+    """
+
+    def __init__(self, geometry, zooms=LOD_ZOOMS):
+        geometry = np.asarray(geometry, dtype=object)
+        self.is_shape = ~np.isin(shapely.get_type_id(geometry), [-1, 0])  # not missing or Point
+        self.shapes = geometry[self.is_shape]
+        # Position of each feature among the shapes
+        self.shape_index = np.cumsum(self.is_shape) - 1
+        self.zooms = sorted(zooms)
+        self.levels = {}
+        # Each level simplifies the next finer one, which has far fewer
+        # vertices than the original; the tolerances shrink eightfold per
+        # level, so the error stays within about one pixel
+        simplified = self.shapes
+        for zoom in reversed(self.zooms):
+            tolerance = pixel_degrees(zoom)
+            simplified = shapely.simplify(simplified, tolerance, preserve_topology=True)
+            self.levels[zoom] = self._serialize(simplified, tolerance / 4)
+        self.full = None
+
+    @staticmethod
+    def _serialize(geometry, grid_size):
+        rounded = shapely.set_precision(geometry, grid_size, mode='pointwise')
+        return shapely.to_geojson(rounded).astype(object)
+
+    def level(self, zoom):
+        """
+        The zoom of the level used at `zoom`, or None for the full geometry.
+        """
+        return next((level for level in self.zooms if level >= zoom), None)
+
+    def geojson(self, zoom, positions):
+        """
+        GeoJSON geometry strings for the features at `positions` (which
+        must be shapes), at the level of detail for `zoom`.
+        """
+        level = self.level(zoom)
+        if level is None:
+            if self.full is None:
+                self.full = self._serialize(self.shapes, pixel_degrees(MAX_ZOOM) / 4)
+            strings = self.full
+        else:
+            strings = self.levels[level]
+        return strings[self.shape_index[positions]]
@@ -0,0 +1,84 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic
+from biomass_data import BiomassQuery, build_cube, isin_codes, read_biomass_csv, rollup
+
+
+@pytest.fixture(scope='module')
+def frames():
+    # The same CSV parsed typed (categoricals) and untyped, with missing dimension values
+    raw = pd.read_csv(io.BytesIO(synthetic.biomass_csv_bytes(5000)))
+    rng = np.random.default_rng(1)
+    for column in ['biomass_sector', 'biomass_commodity', 'biomass_type', 'county']:
+        raw.loc[rng.random(len(raw)) < 0.05, column] = np.nan
+    buffer = raw.to_csv(index=False).encode('utf-8')
+    return read_biomass_csv(buffer, typed=True), read_biomass_csv(buffer, typed=False)
+
+
+@pytest.mark.parametrize('column', ['Biomass Sector', 'Biomass Commodity', 'Biomass Type'])
+def test_isin_codes_matches_series_isin(frames, column):
+    typed, untyped = frames
+    every = list(untyped[column].unique())
+    assert any(pd.isna(value) for value in every)
+    for values in [every, [value for value in every if not pd.isna(value)], every[:2] + [np.nan]]:
+        expected = untyped['Biomas Tons'][untyped[column].isin(values)].sum()
+        assert np.array_equal(isin_codes(typed[column], values), untyped[column].isin(values).to_numpy())
+        assert typed['Biomas Tons'][isin_codes(typed[column], values)].sum() == pytest.approx(expected)
+
+
+def test_typed_tons_sum_like_untyped(frames):
+    typed, untyped = frames
+    assert typed['Biomas Tons'].dtype == np.float64
+    assert typed['Biomas Tons'].sum() == untyped['Biomas Tons'].sum()
+    by_state = typed.groupby('State', observed=True)['Biomas Tons'].sum()
+    assert by_state.to_dict() == untyped.groupby('State')['Biomas Tons'].sum().to_dict()
+
+
+@pytest.fixture(scope='module')
+def cube(frames):
+    return build_cube(frames[0])
+
+
+def test_cube_keeps_groups_with_missing_dimensions(frames, cube):
+    typed, untyped = frames
+    assert cube['Biomas Tons'].sum() == pytest.approx(untyped['Biomas Tons'].sum())
+    for by in [['State'], ['State', 'Source'], ['Biomass Sector'], ['County']]:
+        expected = untyped.groupby(by)['Biomas Tons'].sum()
+        rolled = rollup(cube, by).set_index(by)['Biomas Tons']
+        assert rolled.to_dict() == pytest.approx(expected.to_dict())
+
+
+def test_cube_query_totals_match_raw_rows(frames, cube):
+    typed, untyped = frames
+    state, source = untyped['State'].iloc[0], untyped['Source'].iloc[0]
+    raw = untyped[(untyped['State'] == state) & (untyped['Source'] == source)]
+    query = BiomassQuery(cube).where_in('Source', [source]).where_in('State', [state])
+    for column in ['Biomass Sector', 'Biomass Commodity', 'Biomass Type']:
+        # The page's defaults: every option offered, missing values included
+        selected = query.distinct(column)
+        query.where_in(column, selected)
+        raw = raw[raw[column].isin(selected)]
+    assert query.total(having=False) == pytest.approx(raw['Biomas Tons'].sum())
+    assert query.total(having=False) == pytest.approx(untyped.loc[
+        (untyped['State'] == state) & (untyped['Source'] == source), 'Biomas Tons'].sum())
+
+
+def test_query_on_missing_dimensions_matches_pandas(frames):
+    typed, untyped = frames
+    sectors = [value for value in untyped['Biomass Sector'].unique()][:2] + [np.nan]
+    query = BiomassQuery(typed).where_in('Biomass Sector', sectors)
+    selected = untyped[untyped['Biomass Sector'].isin(sectors)]
+    assert query.total(having=False) == pytest.approx(selected['Biomas Tons'].sum())
+    assert len(query.distinct('Biomass Commodity')) == len(selected['Biomass Commodity'].unique())
+
+    minimum = selected.groupby('County')['Biomas Tons'].sum().median()
+    query.having_min('County', minimum)
+    county_totals = selected.groupby('County')['Biomas Tons'].sum()
+    kept = selected[selected['County'].isin(county_totals[county_totals >= minimum].index)]
+    assert query.total() == pytest.approx(kept['Biomas Tons'].sum())
+    assert np.array_equal(query.positions(), np.flatnonzero(untyped.index.isin(kept.index)))
+    assert query.rows()['Biomas Tons'].sum() == pytest.approx(kept['Biomas Tons'].sum())